@@ -3,39 +3,52 @@
 from __future__ import annotations
 
 from typing import List, Dict
-import fitz  # PyMuPDF
 import io
+import math
+from pathlib import Path
+
+import numpy as np
 
 import streamlit as st
 
 from app_helpers import (
-    LEVELS, LABEL_TO_VAL, VAL_TO_LABEL,
+    LEVELS, LABEL_TO_VAL, VAL_TO_LABEL, LVL_LABELS, LVL_INDEX,
     VAL_TO_LABEL_INDIV, LABEL_TO_VAL_INDIV,
     TOTAL_UPLOAD_CAP_MB, PREVIEW_PDF_DPI, 
     PREVIEW_BOX_W, PREVIEW_BOX_H,
-    RATIO_BY_DENSITY, THUMB_W_BY_DENSITY,
-    format_size, read_uploaded_as_bytes,
+    RATIO_BY_DENSITY, THUMB_W_BY_DENSITY, PAGE_WINDOW,
+    THUMB_CACHE_MAX_BYTES, PIX_CACHE_MAX_BYTES, BoundedLRU,
+    format_size, read_uploaded_as_bytes, upload_size,
     notify, render_toasts,
-    is_pdf, kind_of, format_pct,
+    kind_of, format_pct,
     compute_sorted_order, move_up, move_down,
-    reorder_page_state, thumb_into_box, thumb_key,
-    get_thumb,
+    reorder_page_state, swap_pages, rotate_page, set_keep, set_level, thumb_into_box,
+    get_thumb, thumb_data_uri, get_fitz_doc, close_fitz_docs, content_key, prefetch_rasters,
+    cached_estimate, peek_estimate,
 )
 
 from pdf_ops import (
-    estimate_pdf_size, estimate_image_pdf_size, estimate_pdf_page_size,
+    estimate_pdf_size, estimate_image_pdf_size, estimate_image_pdf_sizes,
+    estimate_pdf_page_size, estimate_pdf_pages_sizes,
     image_to_pdf_bytes, compress_pdf, merge_items, merge_pages, split_pdf,
     RESAMPLE_LANCZOS,
 )
 
+# Opções do seletor individual (montadas 1x; a densidade só escolhe qual usar)
+_LONG_OPTS = LVL_LABELS                            # ("Nenhuma", "Mínima", "Média", "Máxima")
+_SHORT_OPTS = tuple(VAL_TO_LABEL_INDIV.values())   # ("Zero", "Mín", "Méd", "Máx")
+
 
 st.set_page_config(page_title="Edição de PDFs e Imagens → PDF", page_icon="📄", layout="wide")
 st.title("📄 PDF Fácil - Ferramentas para PDF")
 st.caption("Edição de PDFs e Imagens com: União de arquivos, Conversão de imagens para PDF, Compressão, Rotação, Reordenação e Divisão.")
 
-# Cache de miniaturas: (name, size, page, rot) -> PNG bytes
+# Cache de miniaturas: (name, size, page, rot, fmt) -> bytes (JPEG), LRU limitado
 if "_thumb_cache" not in st.session_state:
-    st.session_state._thumb_cache = {}
+    st.session_state._thumb_cache = BoundedLRU(THUMB_CACHE_MAX_BYTES)
+# Raster base por página (sem rotação): (name, size, page) -> np.ndarray RGB, LRU limitado
+if "_pix_cache" not in st.session_state:
+    st.session_state._pix_cache = BoundedLRU(PIX_CACHE_MAX_BYTES)
 
 # Estado inicial
 if "upload_key" not in st.session_state:
@@ -48,6 +61,238 @@ if "last_global_ui" not in st.session_state:
     st.session_state.last_global_ui = "Nenhuma"
 
 
+@st.cache_data(show_spinner=False)
+def load_help(path: str = "ajuda.md") -> str:
+    """Lê o guia de uso 1x por processo (o corpo do expander roda a cada rerun)."""
+    return Path(path).read_text(encoding="utf-8")
+
+
+def page_estimate(fi: int, pi: int, lvl: str) -> int:
+    """Estimativa memoizada (bytes) de uma página/arquivo no nível 'lvl'."""
+    if st.session_state._kinds[fi] == "pdf":
+        doc = get_fitz_doc(fi)
+        return cached_estimate(fi, pi, lvl, lambda: estimate_pdf_page_size(doc, pi, lvl))
+    data = st.session_state._upload_bytes.get(fi, b"")
+    return cached_estimate(fi, 0, lvl, lambda: estimate_image_pdf_size(data, lvl))
+
+
+def prime_estimates(bases) -> None:
+    """Preenche _est_cache ('none' e nível atual) das páginas em 'bases'.
+
+    Agrupa as páginas ainda não estimadas por arquivo e faz UMA chamada em
+    lote por arquivo (estimate_pdf_pages_sizes / estimate_image_pdf_sizes);
+    depois page_estimate só lê o cache.
+    """
+    pf, lv = st.session_state.pages_flat, st.session_state.level_page
+    by_file: dict[int, list[int]] = {}
+    img_lvls: dict[int, set[str]] = {}
+    for b in bases:
+        fi, pi = pf[b]
+        if st.session_state._kinds[fi] != "pdf":
+            for lvl in ("none", lv[b]):
+                if peek_estimate(fi, 0, lvl) is None:
+                    img_lvls.setdefault(fi, set()).add(lvl)
+            continue
+        if peek_estimate(fi, pi, "none") is None or peek_estimate(fi, pi, lv[b]) is None:
+            by_file.setdefault(fi, []).append(b)
+
+    for fi, lvls in img_lvls.items():
+        data = st.session_state._upload_bytes.get(fi, b"")
+        for lvl, n in estimate_image_pdf_sizes(data, lvls).items():
+            cached_estimate(fi, 0, lvl, lambda v=n: v)
+
+    for fi, bs in by_file.items():
+        pis = [pf[b][1] for b in bs]
+        lvls = [lv[b] for b in bs]
+        sizes = estimate_pdf_pages_sizes(get_fitz_doc(fi), pis, lvls)
+        for pi, lvl, (n0, n1) in zip(pis, lvls, sizes):
+            cached_estimate(fi, pi, "none", lambda v=n0: v)
+            cached_estimate(fi, pi, lvl, lambda v=n1: v)
+
+
+def render_page_table(up_uni: list, positions) -> None:
+    """Visão em tabela das posições da janela atual: um único st.data_editor.
+
+    Troca os 4 widgets por card (↑, ↓, Girar, Compressão/Manter) por um só
+    widget; edições voltam para keep_map/rot_map/level_page. Reordenar fica
+    com a seção "Ordenar / Reordenar páginas" ou com a visão em cards.
+    """
+    idx = [st.session_state.order[i] for i in positions]  # índices-base na ordem exibida
+    pf = [st.session_state.pages_flat[b] for b in idx]
+    km, rm, lv = st.session_state.keep_map, st.session_state.rot_map, st.session_state.level_page
+    rev = st.session_state.get("ui_rev", 0)
+    table = {
+        "Miniatura": [thumb_data_uri(get_thumb(up_uni[fi], fi, pi, rm[b]))
+                      for b, (fi, pi) in zip(idx, pf)],
+        "Arquivo": [st.session_state._names[fi] for fi, _ in pf],
+        "Pág": [pi + 1 for _, pi in pf],
+        "Manter": [km[b] for b in idx],
+        "Rotação": [rm[b] for b in idx],
+        "Compressão": [VAL_TO_LABEL[lv[b]] for b in idx],
+    }
+
+    # a chave muda com a ordem/janela/preset global: edições pendentes são
+    # posicionais e não podem ser reaplicadas sobre outra sequência de páginas
+    edited = st.data_editor(
+        table,
+        key=f"grid_table_{rev}_{hash(tuple(idx))}",
+        num_rows="fixed",
+        hide_index=True,
+        use_container_width=True,
+        disabled=["Miniatura", "Arquivo", "Pág"],
+        column_config={
+            "Miniatura": st.column_config.ImageColumn("Miniatura", width="small"),
+            "Rotação": st.column_config.SelectboxColumn("Rotação", options=[0, 90, 180, 270], required=True),
+            "Compressão": st.column_config.SelectboxColumn(
+                "Compressão", options=list(LABEL_TO_VAL.keys()), required=True),
+        },
+    )
+
+    changed = lvl_changed = False
+    for j, b in enumerate(idx):
+        keep = bool(edited["Manter"][j])
+        rot = int(edited["Rotação"][j])
+        lvl = LABEL_TO_VAL[edited["Compressão"][j]]
+        if (keep, rot, lvl) == (km[b], rm[b], lv[b]):
+            continue
+        lvl_changed = lvl_changed or lvl != lv[b]
+        km[b], rm[b], lv[b] = keep, rot, lvl
+        # widgets da visão em cards re-inicializam a partir do estado novo
+        st.session_state.pop(f"lvl_u_{b}_{rev}", None)
+        st.session_state.pop(f"keep_u_{b}", None)
+        changed = True
+    if lvl_changed:
+        # badge/seletor global ficam fora do fragmento
+        st.rerun()
+    elif changed:
+        # miniaturas com a rotação nova
+        st.rerun(scope="fragment")
+
+
+@st.fragment
+def render_page_grid(up_uni: list) -> None:
+    """Grid de cards por página (miniatura + controles).
+
+    Roda como fragmento: ↑/↓, Girar e "Manter" reexecutam só o grid, não o
+    app inteiro. A compressão individual muda o badge e o seletor global
+    (fora do fragmento), então pede rerun completo, assim como as ações
+    globais (ordenar, limpar, nível global).
+
+    Só a janela atual (PAGE_WINDOW cards) é renderizada; as listas de estado
+    continuam com o tamanho total. Com "Mostrar descartadas" desligado, as
+    páginas sem "Manter" saem da lista visível (e da paginação).
+    """
+    if st.session_state.pop("_levels_changed", False):
+        st.rerun()  # escopo app: badge/seletor global com os níveis novos
+    order = st.session_state.order
+    if st.session_state.get("ui_show_unkept", True):
+        visible = range(len(order))
+    else:
+        km = st.session_state.keep_map
+        visible = [i for i, b in enumerate(order) if km[b]]
+    n = len(visible)
+    n_windows = max(1, math.ceil(n / PAGE_WINDOW))
+    if n_windows > 1:
+        # clamp antes do widget: o lote pode ter encolhido desde o último rerun
+        if st.session_state.get("grid_page", 1) > n_windows:
+            st.session_state.grid_page = n_windows
+        st.number_input(
+            f"Página do grid (1–{n_windows})",
+            min_value=1, max_value=n_windows, step=1,
+            key="grid_page",
+            help=f"Mostra {PAGE_WINDOW} páginas por vez para manter o grid leve.",
+        )
+        start = (st.session_state.grid_page - 1) * PAGE_WINDOW
+    else:
+        start = 0
+    end = min(start + PAGE_WINDOW, n)
+    if n == 0:
+        st.caption("Nenhuma página marcada como **Manter**.")
+        return
+
+    if st.session_state.get("ui_grid_view", "Cards") == "Tabela":
+        render_page_table(up_uni, visible[start:end])
+        return
+
+    # Em densidade 3/4 mostramos rótulos longos; em 5 usamos abreviações
+    use_long = st.session_state.density in (3, 4)
+    options_indiv = _LONG_OPTS if use_long else _SHORT_OPTS
+    label_map = VAL_TO_LABEL if use_long else VAL_TO_LABEL_INDIV
+    val_map = LABEL_TO_VAL if use_long else LABEL_TO_VAL_INDIV
+
+    cols = st.columns(st.session_state.density)
+    for j in range(end - start):
+        k = start + j                          # índice na lista visível
+        i = visible[k]                         # posição na ordem (↑/↓)
+        b = order[i]                           # índice-base do estado da página
+        fi, pi = st.session_state.pages_flat[b]
+        uf = up_uni[fi]
+
+        with cols[j % st.session_state.density]:
+            # --- layout do card: imagem (esq) + controles (dir) ---
+            left, right = st.columns(RATIO_BY_DENSITY[st.session_state.density], gap="small")
+
+            with left:
+                # miniatura (mantém resolução do pixmap; só limitamos a largura)
+                # PREVIEW via CACHE (um único ponto de geração)
+                rot = st.session_state.rot_map[b]
+                thumb_img = get_thumb(uf, fi, pi, rot)
+
+                # Fixar largura de exibição para estabilidade do grid
+                st.image(thumb_img, width=THUMB_W_BY_DENSITY[st.session_state.density])
+
+                # Caption de 1 linha (trunca o nome para evitar quebra)
+                _name = st.session_state._names[fi]
+                _name = (_name if len(_name) <= 28 else _name[:25] + "…")
+                st.caption(f"{_name} · pág {pi+1} · rot {rot}°")
+
+
+            with right:
+                # ordem ↑↓ no topo
+                up_col, down_col = st.columns(2)
+                with up_col:
+                    # troca com a vizinha VISÍVEL (descartadas ocultas ficam no lugar)
+                    st.button("↑", key=f"up_u_{i}", use_container_width=True, disabled=(k == 0),
+                              on_click=swap_pages, args=(i, visible[k - 1] if k > 0 else i))
+                with down_col:
+                    st.button("↓", key=f"down_u_{i}", use_container_width=True,
+                            disabled=(k == n - 1),
+                            on_click=swap_pages, args=(i, visible[k + 1] if k < n - 1 else i))
+
+                # girar
+                st.button("Girar ↻", key=f"rot_u_{i}", use_container_width=True,
+                          on_click=rotate_page, args=(b,))
+
+                # --- Compressão individual (init 1x por key; sem index em todo rerun)
+                # --- Compressão individual (init 1x por key; opções conforme densidade)
+                select_key = f"lvl_u_{b}_{st.session_state.get('ui_rev', 0)}"
+
+                # Valor interno atual desta página
+                cur_internal = st.session_state.level_page[b]  # "none"|"min"|"med"|"max"
+                cur_label = label_map[cur_internal]
+
+                # Inicializa 1x OU realinha quando a densidade muda (se o valor salvo não existir nas novas opções)
+                if (select_key not in st.session_state) or (st.session_state[select_key] not in options_indiv):
+                    st.session_state[select_key] = cur_label
+
+                # on_change: level_page atualizado antes do rerun (ver set_level)
+                st.selectbox(
+                    "Compressão",
+                    options_indiv,
+                    key=select_key,   # sem 'index' aqui (evita o bug dos dois cliques)
+                    on_change=set_level, args=(b, select_key, val_map),
+                )
+
+                # Caption com nome completo apenas quando em densidade 5
+                if st.session_state.density == 5:
+                    nivel_val = st.session_state.level_page[b]  # ex.: "med"
+                    st.caption(f"Compressão {VAL_TO_LABEL[nivel_val]}")
+                # manter / remover            
+                # on_change: keep_map já está certo quando o fragmento reexecuta
+                st.checkbox("Manter", value=st.session_state.keep_map[b], key=f"keep_u_{b}",
+                            on_change=set_keep, args=(b,))
+
+
 with st.expander("🧪 Interface Única", expanded=True):
     # 1) Upload + Limpar tudo (full-width, botão integrado no cabeçalho)
     with st.container(border=True):
@@ -58,9 +303,11 @@ with st.expander("🧪 Interface Única", expanded=True):
         with hdr_r:
             if st.button("Limpar tudo", use_container_width=True, key="btn_clear_all"):
                 st.session_state.upload_key += 1
-                for k in ("pages_flat","keep_map","rot_map","level_page",
-                        "_unified_sig","prev_global_choice","last_global_ui",
-                        "_thumb_cache", "_upload_bytes", "orig_order_map"):
+                close_fitz_docs()
+                for k in ("pages_flat","keep_map","rot_map","level_page","order",
+                        "_unified_sig","_up_fid","prev_global_choice","last_global_ui",
+                        "_thumb_cache", "_pix_cache", "_upload_bytes", "orig_order_map",
+                        "_est_cache", "_kinds", "_names", "_file_keys", "_sort_keys"):
                     st.session_state.pop(k, None)
                 st.rerun()
 
@@ -85,34 +332,49 @@ with st.expander("🧪 Interface Única", expanded=True):
         #    - keep_map[i]: bool
         #    - rot_map[i]: int (0/90/180/270)
         #    - level_page[i]: 'none'|'min'|'med'|'max'
+        #    Essas listas ficam FIXAS (índice-base); a ordem exibida é
+        #    st.session_state.order (posição -> índice-base).
         # Assinatura dos uploads (nome + tamanho) para detectar mudanças
-        # --- Cache de bytes por upload (lido 1x por lote) ---
-        # Observação: aqui não dependemos de files_sig ainda.
-        # Se a lista de nomes mudou em relação ao último _unified_sig, recriamos o cache.
-        _curr_names = [getattr(uf, "name", "") for uf in up_uni]
-        _prev_sig = st.session_state.get("_unified_sig", None)
-        _prev_names = [n for (n, _) in _prev_sig] if _prev_sig else None
-
-        if ("_upload_bytes" not in st.session_state) or (_prev_names != _curr_names):
-            st.session_state._upload_bytes = {}
-            for fi, uf in enumerate(up_uni):
-                try:
-                    st.session_state._upload_bytes[fi] = read_uploaded_as_bytes(uf)
-                except Exception:
-                    st.session_state._upload_bytes[fi] = b""
-
-        files_sig = []
-        for fi, uf in enumerate(up_uni):
-            try:
-                size_approx = getattr(uf, "size", None)
-                if size_approx is None:
-                    # agora usamos os bytes já cacheados na sessão (_upload_bytes)
-                    size_approx = len(st.session_state._upload_bytes[fi])
-            except Exception:
-                size_approx = None
-            files_sig.append((getattr(uf, "name", ""), size_approx))
-            # --- Limite global (soma dos arquivos) ---
-            _total_bytes = sum([(s or 0) for _, s in files_sig])
+        # Atalho: mesmos UploadedFile (file_id) do rerun anterior -> nada mudou;
+        # reaproveita a assinatura/bytes do lote sem reconstruir nada
+        _up_fid = tuple(getattr(uf, "file_id", None) for uf in up_uni)
+        _same_upload = (None not in _up_fid
+                        and _up_fid == st.session_state.get("_up_fid")
+                        and "_unified_sig" in st.session_state
+                        and "_upload_bytes" in st.session_state)
+        if _same_upload:
+            files_sig = st.session_state._unified_sig
+        else:
+            # --- Cache de bytes por upload (lido 1x por lote) ---
+            # Observação: aqui não dependemos de files_sig ainda.
+            # Se a lista de nomes mudou em relação ao último _unified_sig, recriamos o cache.
+            _curr_names = [getattr(uf, "name", "") for uf in up_uni]
+            _prev_sig = st.session_state.get("_unified_sig", None)
+            _prev_names = [n for (n, _) in _prev_sig] if _prev_sig else None
+
+            if ("_upload_bytes" not in st.session_state) or (_prev_names != _curr_names):
+                st.session_state._upload_bytes = {}
+                for fi, uf in enumerate(up_uni):
+                    try:
+                        st.session_state._upload_bytes[fi] = read_uploaded_as_bytes(uf)
+                    except Exception:
+                        st.session_state._upload_bytes[fi] = b""
+                # tipo e nome por arquivo, calculados 1x por lote (mesmo gate dos bytes)
+                st.session_state._kinds = [kind_of(uf, st.session_state._upload_bytes[fi])
+                                           for fi, uf in enumerate(up_uni)]
+                st.session_state._names = [getattr(uf, "name", "") or "" for uf in up_uni]
+                # chave por conteúdo (nome + tamanho + hash): identifica o documento
+                # aberto de cada arquivo mesmo com nomes/tamanhos repetidos
+                st.session_state._file_keys = [content_key(st.session_state._names[fi],
+                                                           st.session_state._upload_bytes[fi])
+                                               for fi in range(len(up_uni))]
+
+            files_sig = []
+            for uf in up_uni:
+                # uf.size ou seek/tell: O(1), sem depender do conteúdo
+                files_sig.append((getattr(uf, "name", ""), upload_size(uf)))
+            # --- Limite global (soma dos arquivos) — checado 1x, após montar files_sig ---
+            _total_bytes = sum((s or 0) for _, s in files_sig)
             _total_mb = _total_bytes / (1024 * 1024)
             if _total_mb > TOTAL_UPLOAD_CAP_MB:
                 st.error(
@@ -121,6 +383,7 @@ with st.expander("🧪 Interface Única", expanded=True):
                     "Envie em partes menores ou compacte antes."
                 )
                 st.stop()  # interrompe o restante da UI para este envio
+            st.session_state._up_fid = _up_fid
         # 3) Flatten de páginas (todas as páginas de todos os uploads)
         if ("pages_flat" not in st.session_state) or (st.session_state.get("_unified_sig") != files_sig):
             st.session_state._unified_sig = files_sig
@@ -129,20 +392,25 @@ with st.expander("🧪 Interface Única", expanded=True):
             st.session_state.rot_map = []
             st.session_state.level_page = []
             st.session_state.orig_order_map = {}
+            # estimativas memoizadas: mantém as dos arquivos que seguem no lote
+            _live = set(st.session_state._file_keys)
+            st.session_state._est_cache = {k: v for k, v in st.session_state.get("_est_cache", {}).items()
+                                           if k[:3] in _live}
+            # fecha só os documentos que saíram do lote; os demais seguem abertos
+            close_fitz_docs(keep=st.session_state._file_keys)
             _arrival = 0
             # monta flatten
             for fi, uf in enumerate(up_uni):
-                data = st.session_state._upload_bytes.get(fi, b"")
-                if is_pdf(uf):
+                if st.session_state._kinds[fi] == "pdf":
                     try:
-                        doc = fitz.open("pdf", data)
+                        # abre 1x e mantém aberto na sessão (thumbs/estimativas reaproveitam)
+                        doc = get_fitz_doc(fi)
                         for pi in range(doc.page_count):
                             st.session_state.pages_flat.append((fi, pi))
                             st.session_state.keep_map.append(True)
                             st.session_state.rot_map.append(0)
                             st.session_state.level_page.append(g_val_init)
                             st.session_state.orig_order_map[(fi, pi)] = _arrival; _arrival += 1
-                        doc.close()
                     except Exception:
                         pass
                 else:
@@ -152,6 +420,28 @@ with st.expander("🧪 Interface Única", expanded=True):
                     st.session_state.level_page.append(g_val_init)
                     st.session_state.orig_order_map[(fi, 0)] = _arrival; _arrival += 1
 
+            st.session_state.order = list(range(len(st.session_state.pages_flat)))
+
+            # colunas de ordenação por índice-base (fixas para esta assinatura),
+            # no formato do np.lexsort: (secundária, ..., primária)
+            _pf = st.session_state.pages_flat
+            _lower = np.array([n.lower() for n in st.session_state._names])
+            _kinds = np.array(st.session_state._kinds)
+            _fis = np.fromiter((fi for fi, _ in _pf), dtype=np.int64, count=len(_pf))
+            st.session_state._sort_keys = {
+                "Original": (np.array([st.session_state.orig_order_map[fp] for fp in _pf], dtype=np.int64),),
+                "Nome": (_lower[_fis],),
+                "Tipo": (_lower[_fis], _kinds[_fis]),
+            }
+
+        # ordem exibida sempre cobre todas as páginas (ex.: sessão antiga sem 'order')
+        if len(st.session_state.order) != len(st.session_state.pages_flat):
+            st.session_state.order = list(range(len(st.session_state.pages_flat)))
+
+        # Pré-aquece os rasters da 1ª janela do grid em paralelo (só o que ainda está frio)
+        prefetch_rasters(up_uni, [st.session_state.pages_flat[b]
+                                  for b in st.session_state.order[:PAGE_WINDOW]])
+
         # 4) Controles do grid (preview de todas as páginas)
         st.caption("Selecione, gire, mova e ajuste compressão por página. Se alterado, o Preset Global sobrepõe os individuais.")
         # =======================  ORDENAR / REORDENAR PÁGINAS  =======================
@@ -197,20 +487,15 @@ with st.expander("🧪 Interface Única", expanded=True):
                 new_order = None
                 raw = (manual_str or "").strip()
                 if raw:
-                    seen = set()
-                    parsed = []
-                    for tok in raw.replace(" ", "").split(","):
-                        if not tok:
-                            continue
-                        if tok.isdigit():
-                            k = int(tok) - 1  # 1-based -> 0-based
-                            if 0 <= k < n and k not in seen:
-                                parsed.append(k)
-                                seen.add(k)
-                    # completa com os que faltaram na ordem atual
-                    for k in current_order:
-                        if k not in seen:
-                            parsed.append(k)
+                    # tokens inválidos (vazios, não numéricos) são ignorados, como antes
+                    # (int() + faixa antes do array: números enormes não estouram int64)
+                    toks = [int(t) - 1 for t in raw.replace(" ", "").split(",") if t.isdecimal()]
+                    arr = np.array([v for v in toks if 0 <= v < n], dtype=np.int64)  # 1-based -> 0-based
+                    # 1ª ocorrência de cada posição, na ordem digitada
+                    _, first_idx = np.unique(arr, return_index=True)
+                    arr = arr[np.sort(first_idx)]
+                    # completa com as que faltaram, na ordem atual (setdiff1d devolve ordenado)
+                    parsed = np.concatenate([arr, np.setdiff1d(current_order, arr)])
 
                     if len(parsed) == n:
                         new_order = parsed
@@ -221,24 +506,20 @@ with st.expander("🧪 Interface Única", expanded=True):
                 if new_order is None:
                     reverse = (sort_dir_pages == "Decrescente")
 
-                    # chaves por página (olhando o arquivo de origem da página)
-                    def _page_key(idx: int):
-                        fi, pi = st.session_state.pages_flat[idx]
-                        uf = up_uni[fi]
-                        if sort_primary_pages == "Original":
-                            return st.session_state.orig_order_map.get((fi, pi), idx)
-                        if sort_primary_pages == "Nome":
-                            return (getattr(uf, "name", "") or "").lower()
-                        if sort_primary_pages == "Tipo":
-                            # 'pdf' ou 'image' (mesma lógica dos helpers)
-                            from app_helpers import is_pdf
-                            typ = "pdf" if is_pdf(uf) else "image"
-                            return (typ, (getattr(uf, "name", "") or "").lower())
-                        return idx
-
-                    new_order = sorted(current_order, key=_page_key, reverse=reverse)
-
-                # 3) Aplica a nova ordem às 4 listas de estado
+                    # colunas montadas 1x no flatten; aqui só as reindexamos pela ordem atual
+                    cols = st.session_state.get("_sort_keys", {}).get(sort_primary_pages)
+                    if cols is not None:
+                        o = np.asarray(st.session_state.order, dtype=np.int64)
+                        cols = [c[o] for c in cols]
+                        if not reverse:
+                            new_order = np.lexsort(cols)  # estável
+                        else:
+                            # decrescente preservando a ordem atual nos empates (como sorted(reverse=True))
+                            new_order = (n - 1) - np.lexsort([c[::-1] for c in cols])[::-1]
+                    else:
+                        new_order = current_order
+
+                # 3) Aplica a permutação (arrays NumPy) à indireção order
                 reorder_page_state(new_order)
                 st.rerun()
             st.markdown("---")
@@ -257,112 +538,24 @@ with st.expander("🧪 Interface Única", expanded=True):
 
             # espelho opcional para leitura no restante do código
             st.session_state.density = st.session_state.ui_density
+
+            # Visão do grid: cards (com ↑/↓) ou tabela única (mais leve em lotes grandes)
+            st.radio(
+                "Visualização",
+                options=["Cards", "Tabela"],
+                key="ui_grid_view",
+                horizontal=True,
+                help="Tabela: um único editor para Manter/Rotação/Compressão; reordene pela seção acima.",
+            )
+            st.toggle(
+                "Mostrar descartadas",
+                value=True,
+                key="ui_show_unkept",
+                help="Desligado: páginas sem “Manter” somem do grid (continuam fora do PDF final).",
+            )
         # =====================  FIM ORDENAR / REORDENAR PÁGINAS  =====================
         
-        cols = st.columns(st.session_state.density)
-        for i, (fi, pi) in enumerate(st.session_state.pages_flat):
-            uf = up_uni[fi]
-            
-
-            with cols[i % st.session_state.density]:
-                # --- layout do card: imagem (esq) + controles (dir) ---
-                left, right = st.columns(RATIO_BY_DENSITY[st.session_state.density], gap="small")
-
-                with left:
-                    # miniatura (mantém resolução do pixmap; só limitamos a largura)
-                    # PREVIEW via CACHE (um único ponto de geração)
-                    rot = st.session_state.rot_map[i]
-                    thumb_png = get_thumb(uf, fi, pi, rot)
-
-                    # Fixar largura de exibição para estabilidade do grid
-                    st.image(thumb_png, width=THUMB_W_BY_DENSITY[st.session_state.density])
-
-                    # Caption de 1 linha (trunca o nome para evitar quebra)
-                    _name = getattr(uf, "name", "") or ""
-                    _name = (_name if len(_name) <= 28 else _name[:25] + "…")
-                    st.caption(f"{_name} · pág {pi+1} · rot {rot}°")
-
-
-                with right:
-                    # ordem ↑↓ no topo
-                    up_col, down_col = st.columns(2)
-                    with up_col:
-                        st.button("↑", key=f"up_u_{i}", use_container_width=True, disabled=(i == 0))
-                    with down_col:
-                        st.button("↓", key=f"down_u_{i}", use_container_width=True,
-                                disabled=(i == len(st.session_state.pages_flat) - 1))
-
-                    # girar
-                    if st.button("Girar ↻", key=f"rot_u_{i}", use_container_width=True):
-                        old_rot = st.session_state.rot_map[i]
-                        new_rot = {0: 90, 90: 180, 180: 270, 270: 0}[old_rot]
-                        st.session_state.rot_map[i] = new_rot
-                        # invalida somente a miniatura anterior desta página
-                        try:
-                            old_key = thumb_key(fi, pi, old_rot)
-                            st.session_state._thumb_cache.pop(old_key, None)
-                        except Exception:
-                            pass
-                        st.rerun()
-
-                    # --- Compressão individual (init 1x por key; sem index em todo rerun)
-                    # --- Compressão individual (init 1x por key; opções conforme densidade)
-                    select_key = f"lvl_u_{i}_{st.session_state.get('ui_rev', 0)}"
-
-                    # Em densidade 3/4 mostramos rótulos longos; em 5 usamos abreviações
-                    use_long = st.session_state.density in (3, 4)
-
-                    if use_long:
-                        options_indiv = ["Nenhuma", "Mínima", "Média", "Máxima"]
-                    else:
-                        # usa os rótulos curtos padronizados no helpers: ["Zero","Mín","Méd","Máx"]
-                        options_indiv = list(VAL_TO_LABEL_INDIV.values())
-
-                    # Valor interno atual desta página
-                    cur_internal = st.session_state.level_page[i]  # "none"|"min"|"med"|"max"
-                    cur_label = (VAL_TO_LABEL[cur_internal] if use_long else VAL_TO_LABEL_INDIV[cur_internal])
-
-                    # Inicializa 1x OU realinha quando a densidade muda (se o valor salvo não existir nas novas opções)
-                    if (select_key not in st.session_state) or (st.session_state[select_key] not in options_indiv):
-                        st.session_state[select_key] = cur_label
-
-                    lvl_lbl = st.selectbox(
-                        "Compressão",
-                        options_indiv,
-                        key=select_key,   # sem 'index' aqui (evita o bug dos dois cliques)
-                    )
-
-                    # Atualiza o nível interno conforme o conjunto em uso
-                    if use_long:
-                        st.session_state.level_page[i] = LABEL_TO_VAL[lvl_lbl]
-                    else:
-                        st.session_state.level_page[i] = LABEL_TO_VAL_INDIV[lvl_lbl]
-
-                    # Caption com nome completo apenas quando em densidade 5
-                    if st.session_state.density == 5:
-                        nivel_val = st.session_state.level_page[i]  # ex.: "med"
-                        st.caption(f"Compressão {VAL_TO_LABEL[nivel_val]}")
-                    # manter / remover            
-                    keep = st.checkbox("Manter", value=st.session_state.keep_map[i], key=f"keep_u_{i}")
-                    st.session_state.keep_map[i] = keep
-
-                # mover implementa swap + rerun (fora do 'right' pra rodar sempre que clicar)
-                if st.session_state.get(f"up_u_{i}"):
-                    n = len(st.session_state.pages_flat)
-                    if i > 0:
-                        current = list(range(n))
-                        current[i - 1], current[i] = current[i], current[i - 1]
-                        reorder_page_state(current)
-                        st.rerun()
-
-                if st.session_state.get(f"down_u_{i}"):
-                    n = len(st.session_state.pages_flat)
-                    if i < n - 1:
-                        current = list(range(n))
-                        current[i + 1], current[i] = current[i], current[i + 1]
-                        reorder_page_state(current)
-                        st.rerun()
-
+        render_page_grid(up_uni)
 
 
         # badge de personalizado — compara com o global atual salvo na sessão
@@ -391,9 +584,8 @@ with st.expander("🧪 Interface Única", expanded=True):
             s = set(levels_now)
             divergent = (len(s) > 1) or (len(s) == 1 and next(iter(s)) != g_val_prev)
 
-        base_opts = ["Nenhuma", "Mínima", "Média", "Máxima"]
-        opts = base_opts + (["Personalizado"] if divergent else [])
-        idx  = (opts.index("Personalizado") if divergent else opts.index(g_label_prev))
+        opts = LVL_LABELS + (("Personalizado",) if divergent else ())
+        idx  = len(LVL_LABELS) if divergent else LVL_INDEX.get(g_label_prev, 0)
 
         st.divider()
 
@@ -416,22 +608,17 @@ with st.expander("🧪 Interface Única", expanded=True):
 
             # (abaixo esquerdo) botão Estimar
             if st.button("Estimar tamanho final", use_container_width=True):
-                total_before = total_after = 0
-                for (fi, pi), keep, lvl in zip(
-                    st.session_state.pages_flat,
-                    st.session_state.keep_map,
-                    st.session_state.level_page
-                ):
-                    if not keep:
-                        continue
-                    uf = up_uni[fi]
-                    data = st.session_state._upload_bytes.get(fi, b"")
-                    if is_pdf(uf):
-                        total_before += estimate_pdf_page_size(data, pi, "none")
-                        total_after  += estimate_pdf_page_size(data, pi, lvl)
-                    else:
-                        total_before += estimate_image_pdf_size(data, "none")
-                        total_after  += estimate_image_pdf_size(data, lvl)
+                pf = st.session_state.pages_flat
+                lv = st.session_state.level_page
+                # só as páginas mantidas entram (e só elas são estimadas)
+                kept = np.flatnonzero(np.asarray(st.session_state.keep_map, dtype=bool))
+                prime_estimates(kept.tolist())
+                np_before = np.fromiter((page_estimate(*pf[i], "none") for i in kept),
+                                        dtype=np.int64, count=kept.size)
+                np_after = np.fromiter((page_estimate(*pf[i], lv[i]) for i in kept),
+                                       dtype=np.int64, count=kept.size)
+                total_before = int(np_before.sum())
+                total_after = int(np_after.sum())
 
                 st.session_state._last_est_before = total_before
                 st.session_state._last_est_after  = total_after
@@ -451,30 +638,42 @@ with st.expander("🧪 Interface Única", expanded=True):
             # (abaixo direito) Gerar PDF
             if st.button("Gerar PDF", use_container_width=True):
                 seq, rots = [], []
-                for i, (fi, pi) in enumerate(st.session_state.pages_flat):
+                for i in st.session_state.order:  # índices-base na ordem exibida
+                    fi, pi = st.session_state.pages_flat[i]
                     if not st.session_state.keep_map[i]:
                         continue
-                    uf = up_uni[fi]
                     data = st.session_state._upload_bytes.get(fi, b"")
-                    kind = "pdf" if is_pdf(uf) else "image"
+                    kind = st.session_state._kinds[fi]
                     lvl  = st.session_state.level_page[i]
 
                     # guard-rail por página: se não reduzir, força 'none' nesta página
                     try:
                         if kind == "pdf" and lvl != "none":
-                            b0 = estimate_pdf_page_size(data, pi, "none")
-                            b1 = estimate_pdf_page_size(data, pi, lvl)
-                            if b1 >= b0:
+                            # PDF: merge_pages já escolhe a menor versão por página; aqui só
+                            # aproveitamos estimativas prontas (ex.: do Estimar) para pular
+                            # a geração de candidatos — sem uma segunda passada de estimativa
+                            b0 = peek_estimate(fi, pi, "none")
+                            b1 = peek_estimate(fi, pi, lvl)
+                            if b0 is not None and b1 is not None and b1 >= b0:
                                 lvl = "none"
                         if kind == "image" and lvl != "none":
-                            b0 = estimate_image_pdf_size(data, "none")
-                            b1 = estimate_image_pdf_size(data, lvl)
+                            b0 = page_estimate(fi, pi, "none")
+                            b1 = page_estimate(fi, pi, lvl)
                             if b1 >= b0:
                                 lvl = "none"
                     except Exception:
                         pass
 
-                    seq.append((uf.name, data, kind, pi, lvl))
+                    # PDF: reaproveita o documento já aberto na sessão (sem reparse),
+                    # mas só se ele foi aberto exatamente destes bytes (file_key inclui
+                    # o conteúdo); senão, passa os bytes como antes e o merge reabre
+                    src = data
+                    if kind == "pdf":
+                        doc = get_fitz_doc(fi)
+                        stream = getattr(doc, "stream", None)
+                        if stream is data or stream == data:
+                            src = doc
+                    seq.append((st.session_state._names[fi], src, kind, pi, lvl))
                     rots.append(st.session_state.rot_map[i])
 
                 try:
@@ -487,6 +686,5 @@ with st.expander("🧪 Interface Única", expanded=True):
 
 
 with st.expander("ℹ️ Ajuda", expanded=False):
-    with open("ajuda.md", "r", encoding="utf-8") as f:
-        st.markdown(f.read(), unsafe_allow_html=False)
+    st.markdown(load_help(), unsafe_allow_html=False)
 
@@ -7,21 +7,39 @@ Utilitários para a interface Streamlit:
 - Toasts (notificações efêmeras) com state
 - Ordenação e reordenação de páginas no state
 - Geração de thumbnails cacheadas (PDF/JPG/PNG)
+- Documentos PyMuPDF abertos uma vez por sessão
 """
 
 from __future__ import annotations
-from typing import Dict
+from collections import OrderedDict
+from operator import itemgetter
+from concurrent.futures import as_completed
+from typing import Dict, Tuple
+import hashlib
+import os
 import time
 import streamlit as st
 from PIL import Image, ImageOps
 import io
+import base64
+import numpy as np
 import fitz  # PyMuPDF
 
+from pdf_ops import (
+    LEVELS, PARALLEL_MIN_PAGES, pool_workers, process_pool, render_page_raster, render_pdf_rasters,
+)
+
 try:
     RESAMPLE_LANCZOS = Image.Resampling.LANCZOS  # pyright: ignore[reportAttributeAccessIssue]
+    RESAMPLE_BILINEAR = Image.Resampling.BILINEAR  # pyright: ignore[reportAttributeAccessIssue]
 except AttributeError:
     # Pillow < 10 mantém o alias antigo
     RESAMPLE_LANCZOS = Image.LANCZOS  # pyright: ignore[reportAttributeAccessIssue]
+    RESAMPLE_BILINEAR = Image.BILINEAR  # pyright: ignore[reportAttributeAccessIssue]
+
+# Previews (~200×300 na tela): bilinear é indistinguível do Lanczos nesse tamanho
+# e ~2× mais barato; LANCZOS fica para o PDF de saída (pdf_ops)
+PREVIEW_RESAMPLE = RESAMPLE_BILINEAR
 
 # Limite global de upload (soma de todos os arquivos enviados de uma vez)
 TOTAL_UPLOAD_CAP_MB = 75
@@ -29,23 +47,31 @@ TOTAL_UPLOAD_CAP_MB = 75
 # Previews: parâmetros “leves”
 PREVIEW_PDF_DPI = 60
 PREVIEW_BOX_W, PREVIEW_BOX_H = 200, 300
+# Thumbnails em JPEG (sem alfa): fundo sólido neutro no box e qualidade moderada.
+# "WEBP" também é aceito: ~35% menos bytes por miniatura, mas encode ~6–20× mais
+# lento que o JPEG nesse tamanho — como cada miniatura é cacheada, fica opcional.
+PREVIEW_FMT = "JPEG"
+PREVIEW_JPEG_Q = 75
+PREVIEW_WEBP_Q = 80
+PREVIEW_BG = (240, 240, 240)
+# Teto de memória (por sessão) dos caches de preview
+THUMB_CACHE_MAX_BYTES = 64 * 1024 * 1024   # miniaturas codificadas
+PIX_CACHE_MAX_BYTES = 128 * 1024 * 1024    # rasters base (np.ndarray)
+# Pré-aquecimento paralelo dos rasters (processos via pdf_ops.process_pool;
+# abaixo de PARALLEL_MIN_PAGES páginas frias, o custo de subir processos não compensa)
+PREFETCH_BATCH = 8        # páginas por tarefa (cada tarefa abre o PDF 1x)
 
 # --------- PRESETS ---------
-# Mapa de níveis internos -> parâmetros da engine
-LEVELS: Dict[str, dict] = {
-    "none": {"mode": "none", "dpi": None, "jpg_q": None},
-    # "smart": rasteriza apenas páginas "imagem-only" (detectadas), preservando vetores/texto
-    "min":  {"mode": "smart", "dpi": 200, "jpg_q": 85},
-    # "all": rasteriza todas as páginas
-    "med":  {"mode": "all",   "dpi": 150, "jpg_q": 70},
-    "max":  {"mode": "all",   "dpi": 110, "jpg_q": 50},
-}
-
+# LEVELS (níveis internos -> parâmetros da engine) vem de pdf_ops
 LABEL_TO_VAL = {"Nenhuma": "none", "Mínima": "min", "Média": "med", "Máxima": "max"}
 VAL_TO_LABEL = {v: k for k, v in LABEL_TO_VAL.items()}
 LABEL_TO_VAL_INDIV = {"Zero": "none", "Mín": "min", "Méd": "med", "Máx": "max"}
 VAL_TO_LABEL_INDIV = {v: k for k, v in LABEL_TO_VAL_INDIV.items()}
 
+# Rótulos em ordem fixa + posição de cada um (evita list(...).index() a cada rerun)
+LVL_LABELS: Tuple[str, ...] = tuple(LABEL_TO_VAL.keys())
+LVL_INDEX: Dict[str, int] = {lbl: i for i, lbl in enumerate(LVL_LABELS)}
+
 # ---- Densidade do grid: colunas e largura do thumb por densidade (3, 4, 5)
 RATIO_BY_DENSITY = {
     3: (0.50, 0.50),
@@ -58,6 +84,60 @@ THUMB_W_BY_DENSITY = {
     5: 180,
 }
 
+# ---- Paginação do grid: cards renderizados por página (o resto não gera thumb)
+PAGE_WINDOW = 50
+
+
+
+# --------- CACHE LRU LIMITADO POR BYTES ---------
+class BoundedLRU:
+    """Cache LRU (OrderedDict) com orçamento total em bytes.
+
+    Cada valor conta pelo seu tamanho (len() para bytes, .nbytes para
+    np.ndarray). Ao estourar 'max_bytes', descarta os menos usados.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = int(max_bytes)
+        self.sum_bytes = 0
+        self._data: OrderedDict = OrderedDict()
+
+    @staticmethod
+    def _size_of(value) -> int:
+        nbytes = getattr(value, "nbytes", None)
+        return int(nbytes) if nbytes is not None else len(value)
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Devolve o valor (marcando como recém-usado) ou 'default'."""
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key, value) -> None:
+        """Insere/atualiza e descarta os mais antigos até caber no orçamento."""
+        if key in self._data:
+            self.sum_bytes -= self._size_of(self._data.pop(key))
+        self._data[key] = value
+        self.sum_bytes += self._size_of(value)
+        # mantém sempre o item recém-inserido, mesmo se sozinho passar do teto
+        while self.sum_bytes > self.max_bytes and len(self._data) > 1:
+            _, old = self._data.popitem(last=False)
+            self.sum_bytes -= self._size_of(old)
+
+    def pop(self, key, default=None):
+        """Remove a chave (se existir) e devolve o valor."""
+        if key not in self._data:
+            return default
+        value = self._data.pop(key)
+        self.sum_bytes -= self._size_of(value)
+        return value
 
 
 # --------- FORMATAÇÃO ---------
@@ -73,20 +153,29 @@ def format_size(num_bytes: int | None) -> str:
 
     if num_bytes is None:
         return "—"
-    kb = 1024.0
-    mb = kb * 1024.0
-    if num_bytes >= mb:
-        return f"{num_bytes/mb:.2f} MB".replace(".", ",")
-    if num_bytes >= kb:
-        return f"{num_bytes/kb:.0f} kB".replace(".", ",")
-    return f"{num_bytes} B"
+    n = int(num_bytes)
+    if n >= 1 << 20:
+        c = _div_round_even(n * 100, 1 << 20)  # centésimos de MB
+        return f"{c // 100},{c % 100:02d} MB"
+    if n >= 1 << 10:
+        return f"{_div_round_even(n, 1 << 10)} kB"
+    return f"{n} B"
+
+def _div_round_even(a: int, b: int) -> int:
+    """a/b arredondado como o format ':.Nf' (empate -> par), só com inteiros."""
+    q, r = divmod(a, b)
+    if 2 * r > b or (2 * r == b and q % 2):
+        q += 1
+    return q
 
 
 # --------- LEITURA SEGURA DE UPLOAD ---------
 def read_uploaded_as_bytes(uf) -> bytes:
     """Lê um arquivo de upload (UploadedFile/BytesIO) e retorna bytes.
 
-    Reseta o ponteiro após a leitura para não interferir em usos futuros.
+    Usa ``getvalue()`` quando disponível: devolve o buffer inteiro sem cópia
+    e sem depender da posição do ponteiro (um ``read()`` após leitura parcial
+    em outro ponto devolveria conteúdo truncado). Fallback: ``read()`` + reset.
 
     Args:
         uf: Objeto de upload do Streamlit ou similar.
@@ -96,12 +185,41 @@ def read_uploaded_as_bytes(uf) -> bytes:
     """
 
     try:
+        getvalue = getattr(uf, "getvalue", None)
+        if getvalue is not None:
+            return getvalue()
+        uf.seek(0)
         data = uf.read()
         uf.seek(0)
         return data
     except Exception:
         return b""
 
+def upload_size(uf) -> int | None:
+    """Tamanho do upload em bytes sem ler o conteúdo.
+
+    Usa ``uf.size`` (UploadedFile); se não houver, mede com seek/tell e
+    restaura a posição do ponteiro.
+
+    Args:
+        uf: Objeto de upload do Streamlit ou similar.
+
+    Returns:
+        int | None: Tamanho em bytes, ou None se não for possível medir.
+    """
+
+    size = getattr(uf, "size", None)
+    if size is not None:
+        return size
+    try:
+        pos = uf.tell()
+        uf.seek(0, os.SEEK_END)
+        size = uf.tell()
+        uf.seek(pos)
+        return size
+    except Exception:
+        return None
+
 def notify(key: str, msg: str, icon: str | None = None):
     """Registra/atualiza um toast identificado por chave no session_state.
 
@@ -161,16 +279,28 @@ def is_pdf(uf) -> bool:
     typ = (getattr(uf, "type", "") or "").lower()
     return typ.endswith("pdf") or name.lower().endswith(".pdf")
 
-def kind_of(uf) -> str:
+def kind_of(uf, data: bytes | None = None) -> str:
     """Classifica o upload como 'pdf' ou 'image'.
 
+    Com 'data', decide pelos magic bytes (JPEG/PNG pela assinatura no offset 0;
+    depois ``%PDF-`` no início): um upload com extensão trocada não passa pelo
+    fitz.open à toa. Sem assinatura reconhecida, cai no mimetype/extensão.
+
     Args:
         uf: Objeto de upload do Streamlit (ou compatível).
+        data (bytes | None): Conteúdo do upload, se já lido.
 
     Returns:
         str: 'pdf' ou 'image'.
     """
 
+    if data:
+        head = bytes(data[:1024])
+        # assinaturas de imagem no offset 0 primeiro: um JPEG pode ter "%PDF-" no EXIF
+        if head.startswith(b"\xff\xd8\xff") or head.startswith(b"\x89PNG\r\n\x1a\n"):
+            return "image"
+        if b"%PDF-" in head:  # a spec tolera lixo antes do header
+            return "pdf"
     return "pdf" if is_pdf(uf) else "image"
 
 
@@ -262,6 +392,106 @@ def move_down(pos: int) -> None:
         order[pos + 1], order[pos] = order[pos], order[pos + 1]
         st.session_state.order = order  # garante persistência
 
+# --------- Estimativas memoizadas (por lote) ---------
+def cached_estimate(fi: int, pi: int, lvl: str, compute) -> int:
+    """Memoiza estimativas por (file_key, página, nível) em _est_cache.
+
+    A estimativa é pura em relação às entradas, então Estimar e Gerar
+    compartilham o mesmo resultado. O cache é zerado quando a assinatura
+    do upload muda.
+
+    Args:
+        fi (int): Índice do arquivo no upload atual.
+        pi (int): Índice da página (0-based; 0 para imagens).
+        lvl (str): Nível interno ('none'|'min'|'med'|'max').
+        compute (Callable[[], int]): Calcula a estimativa em caso de miss.
+
+    Returns:
+        int: Tamanho estimado em bytes.
+    """
+
+    key = _est_key(fi, pi, lvl)
+    cache = st.session_state.setdefault("_est_cache", {})
+    if key not in cache:
+        cache[key] = compute()
+    return cache[key]
+
+def peek_estimate(fi: int, pi: int, lvl: str) -> int | None:
+    """Devolve a estimativa já memoizada (ou None), sem calcular nada."""
+    return st.session_state.get("_est_cache", {}).get(_est_key(fi, pi, lvl))
+
+def _est_key(fi: int, pi: int, lvl: str) -> tuple:
+    """Chave de _est_cache: (name, tamanho, digest, página, nível) — ver file_key."""
+    return (*file_key(fi), int(pi), lvl)
+
+
+# --------- Documentos PyMuPDF (abertos 1x por lote) ---------
+def content_key(name: str, data: bytes) -> tuple:
+    """Chave única por conteúdo de um upload: (name, tamanho, blake2b dos bytes).
+
+    Dois arquivos com mesmo nome e tamanho (ex.: 'scan.pdf' de pastas
+    diferentes) têm chaves diferentes; só conteúdo idêntico compartilha.
+    """
+    return (name or "", len(data), hashlib.blake2b(data, digest_size=16).digest())
+
+def file_key(fi: int) -> tuple:
+    """Chave de conteúdo do arquivo 'fi' (calculada 1x por lote em _file_keys)."""
+    return st.session_state._file_keys[fi]
+
+def get_fitz_doc(fi: int) -> "fitz.Document":
+    """Devolve o fitz.Document do arquivo 'fi', abrindo-o só na primeira vez.
+
+    O documento fica em st.session_state._fitz_docs, indexado pela chave de
+    conteúdo do arquivo (file_key), e é reaproveitado entre reruns (thumbnails,
+    estimativas) e entre lotes da MESMA sessão (ex.: adicionar um arquivo não
+    reabre os que já estavam). Se tiver sido fechado (ex.: rerun após
+    "Limpar tudo"), é reaberto a partir de _upload_bytes.
+
+    Args:
+        fi (int): Índice do arquivo no upload atual.
+
+    Returns:
+        fitz.Document: Documento aberto (não feche; use close_fitz_docs).
+    """
+
+    docs = st.session_state.setdefault("_fitz_docs", {})
+    sig = file_key(fi)
+    doc = docs.get(sig)
+    if doc is None or doc.is_closed:
+        data = st.session_state._upload_bytes.get(fi, b"")
+        # stream=bytes: o MuPDF lê direto do buffer Python (sem cópia extra)
+        doc = fitz.open(stream=data, filetype="pdf")
+        docs[sig] = doc
+    return doc
+
+def close_fitz_docs(keep=None) -> None:
+    """Fecha e descarta os documentos abertos em _fitz_docs.
+
+    Chamado no "Limpar tudo" (fecha todos) e quando a assinatura do upload
+    muda (fecha só os arquivos que saíram do lote).
+
+    Args:
+        keep (Iterable[tuple] | None): Chaves de conteúdo (file_key) que
+            continuam no lote e devem ficar abertas. None fecha tudo.
+
+    Returns:
+        None
+    """
+
+    docs = st.session_state.pop("_fitz_docs", None) or {}
+    keep = {tuple(k) for k in keep} if keep is not None else set()
+    kept = {}
+    for sig, doc in docs.items():
+        if sig in keep and not doc.is_closed:
+            kept[sig] = doc
+            continue
+        try:
+            doc.close()
+        except Exception:
+            pass
+    if kept:
+        st.session_state._fitz_docs = kept
+
 def thumb_key(fi: int, pi: int, rot: int) -> tuple:
     """Gera a chave estável do cache de thumbnail para (arquivo, página, rotação).
 
@@ -278,102 +508,266 @@ def thumb_key(fi: int, pi: int, rot: int) -> tuple:
     """
 
     name, size = st.session_state._unified_sig[fi]
-    return (name or "", int(size or 0), int(pi), int(rot))
+    # PREVIEW_FMT no fim: trocar o formato invalida entradas antigas
+    return (name or "", int(size or 0), int(pi), int(rot), PREVIEW_FMT)
 
-def get_thumb(uf, fi: int, pi: int, rot: int) -> bytes:
-    """Obtém (ou gera) a miniatura PNG de uma página/arquivo e cacheia.
+def _raster_box(rot: int) -> tuple[int, int]:
+    """Box (w, h) que o raster SEM rotação deve preencher para a rotação dada.
+
+    É a área interna do thumb_into_box (box − margem de 4px por lado). Em
+    90/270 o raster é girado depois, então ele cabe no box transposto.
+    """
+    w, h = PREVIEW_BOX_W - 8, PREVIEW_BOX_H - 8
+    return (h, w) if (rot // 90) % 2 else (w, h)
+
+def _raster_key(fi: int, pi: int, rot: int) -> tuple:
+    """Chave de _pix_cache: (name, size, page, orientação do box)."""
+    return thumb_key(fi, pi, 0)[:3] + ((rot // 90) % 2,)
+
+def _page_raster(uf, fi: int, pi: int, rot: int = 0) -> np.ndarray:
+    """Rasteriza a página/arquivo (orientação original) no tamanho exato do box.
 
-    Respeita a rotação solicitada e usa resolução reduzida para PDFs.
+    O array fica em st.session_state._pix_cache, chaveado pela orientação do
+    box: 0/180 reaproveitam um raster e 90/270 outro. Como o raster já tem o
+    tamanho final, o thumb_into_box só centraliza (sem novo resize).
 
     Args:
         uf: Objeto UploadedFile referente ao arquivo de origem.
         fi (int): Índice do arquivo no upload atual.
         pi (int): Índice da página (0-based).
-        rot (int): Rotação aplicada (0/90/180/270).
+        rot (int): Rotação que será aplicada depois (define o box).
 
     Returns:
-        bytes: PNG em bytes da miniatura.
+        np.ndarray: Array uint8 (H, W, 3), ou (H, W) em páginas monocromáticas.
     """
 
-    key = thumb_key(fi, pi, rot)
-    cache = st.session_state._thumb_cache
-    if key in cache:
-        return cache[key]
-
-    # Prefere cache do app (se existir) para evitar I/O repetido
-    data = None
-    try:
-        data = st.session_state._upload_bytes.get(fi, None)
-    except Exception:
-        data = None
-    if data is None:
-        data = read_uploaded_as_bytes(uf)
-
-    # Gera imagem base
-    if is_pdf(uf):
+    key = _raster_key(fi, pi, rot)
+    box = _raster_box(rot)
+    if "_pix_cache" not in st.session_state:
+        st.session_state._pix_cache = BoundedLRU(PIX_CACHE_MAX_BYTES)
+    pix_cache = st.session_state._pix_cache
+    arr = pix_cache.get(key)
+    if arr is not None:
+        return arr
+
+    # Gera imagem base (tipo já calculado 1x por lote em _kinds)
+    if st.session_state._kinds[fi] == "pdf":
         try:
-            doc = fitz.open("pdf", data)
-            pg = doc.load_page(pi)
-            pix = pg.get_pixmap(dpi=PREVIEW_PDF_DPI, alpha=False)  # type: ignore[attr-defined]
-            img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
-            doc.close()
+            # documento já aberto na sessão (sem reparse a cada miniatura)
+            doc = get_fitz_doc(fi)
+            arr = render_page_raster(doc.load_page(pi), PREVIEW_PDF_DPI, box)
+            pix_cache.put(key, arr)
+            return arr
         except Exception:
             img = Image.new("RGB", (180, 240), (230, 230, 230))
     else:
+        # Prefere cache do app (se existir) para evitar I/O repetido
+        data = None
         try:
-            img = Image.open(io.BytesIO(data)).convert("RGB")
+            data = st.session_state._upload_bytes.get(fi, None)
+        except Exception:
+            data = None
+        if data is None:
+            data = read_uploaded_as_bytes(uf)
+        try:
+            img = Image.open(io.BytesIO(data))
+            if img.format == "JPEG":
+                # decodifica já reduzido no domínio DCT (1/2, 1/4, 1/8), nunca abaixo
+                # de 2× o box — o resize seguinte roda sobre bem menos pixels
+                img.draft("RGB", (box[0] * 2, box[1] * 2))
+            img = img.convert("RGB")
         except Exception:
             img = Image.new("RGB", (180, 240), (230, 230, 230))
 
+    arr = _fit_raster(img, box)
+    pix_cache.put(key, arr)
+    return arr
+
+def _fit_raster(img: Image.Image, box: tuple[int, int]) -> np.ndarray:
+    """Reduz a imagem para caber no box w×h e devolve como array (RGB ou L)."""
+    img.thumbnail(box, PREVIEW_RESAMPLE)
+    return np.asarray(img)
+
+def prefetch_rasters(uploaded, pages_flat) -> None:
+    """Pré-aquece _pix_cache em paralelo para as páginas de PDF ainda sem raster.
+
+    Usa processos (o PyMuPDF não libera o GIL, então threads não rendem).
+    Só dispara com várias CPUs e páginas suficientes; em qualquer falha, o
+    grid continua gerando sob demanda via get_thumb.
+
+    Args:
+        uploaded: Lista de arquivos enviados (objetos UploadedFile).
+        pages_flat: Lista de (file_idx, page_idx) a aquecer.
+
+    Returns:
+        None
+    """
+
+    if "_pix_cache" not in st.session_state:
+        st.session_state._pix_cache = BoundedLRU(PIX_CACHE_MAX_BYTES)
+    pix_cache = st.session_state._pix_cache
+    kinds = st.session_state._kinds
+
+    # páginas frias agrupadas por arquivo
+    cold: Dict[int, list[int]] = {}
+    for fi, pi in pages_flat:
+        if kinds[fi] == "pdf" and _raster_key(fi, pi, 0) not in pix_cache:
+            cold.setdefault(fi, []).append(pi)
+    if sum(len(v) for v in cold.values()) < PARALLEL_MIN_PAGES:
+        return
+    tasks = [(fi, pages[k:k + PREFETCH_BATCH])
+             for fi, pages in cold.items() for k in range(0, len(pages), PREFETCH_BATCH)]
+    workers = pool_workers(len(tasks))
+    if workers < 2:
+        return
+
+    box = _raster_box(0)  # páginas recém-enviadas ainda não têm rotação
+    try:
+        with process_pool(workers) as ex:
+            futs = {}
+            for fi, chunk in tasks:
+                data = st.session_state._upload_bytes.get(fi, b"")
+                futs[ex.submit(render_pdf_rasters, data, chunk, PREVIEW_PDF_DPI, box)] = (fi, chunk)
+            for fut in as_completed(futs):
+                fi, chunk = futs[fut]
+                for pi, arr in zip(chunk, fut.result()):
+                    pix_cache.put(_raster_key(fi, pi, 0), arr)
+    except Exception:
+        pass  # fallback: geração sob demanda no loop do grid
+
+def get_thumb(uf, fi: int, pi: int, rot: int) -> bytes:
+    """Obtém (ou gera) a miniatura (JPEG) de uma página/arquivo e cacheia.
+
+    A rasterização é feita 1x por página e orientação do box (ver
+    _page_raster); a rotação é aplicada sobre o array com np.rot90.
+
+    Args:
+        uf: Objeto UploadedFile referente ao arquivo de origem.
+        fi (int): Índice do arquivo no upload atual.
+        pi (int): Índice da página (0-based).
+        rot (int): Rotação aplicada (0/90/180/270).
+
+    Returns:
+        bytes: JPEG em bytes da miniatura.
+    """
+
+    key = thumb_key(fi, pi, rot)
+    cache = st.session_state._thumb_cache
+    hit = cache.get(key)
+    if hit is not None:
+        return hit
+
+    thumb = render_thumb(_page_raster(uf, fi, pi, rot), rot)
+    cache.put(key, thumb)
+    return thumb
+
+def render_thumb(arr: np.ndarray, rot: int) -> bytes:
+    """Função pura: raster base (sem rotação) -> miniatura codificada no box.
+
+    Não toca em session_state nem em uploads; o cache fica com get_thumb
+    (por sessão — os arquivos não podem sobreviver à sessão do usuário).
+
+    Args:
+        arr (np.ndarray): Raster base (H, W, 3) ou (H, W).
+        rot (int): Rotação aplicada (0/90/180/270).
+
+    Returns:
+        bytes: Miniatura no formato PREVIEW_FMT.
+    """
+
     if rot in (90, 180, 270):
-        img = img.rotate(-rot, expand=True)
+        # np.rot90 gira no sentido anti-horário; k negativo = horário
+        arr = np.rot90(arr, k=-(rot // 90))
+    return thumb_into_box(
+        Image.fromarray(arr), box_w=PREVIEW_BOX_W, box_h=PREVIEW_BOX_H,
+        bg=PREVIEW_BG, fmt=PREVIEW_FMT,
+    )
 
-    png = thumb_into_box(img, box_w=PREVIEW_BOX_W, box_h=PREVIEW_BOX_H)
-    cache[key] = png
-    return png
 
+def thumb_data_uri(data: bytes) -> str:
+    """Converte os bytes de uma thumbnail em data URI (para ImageColumn).
 
-def thumb_into_box(img: Image.Image, box_w: int = 240, box_h: int = 320, bg=None) -> bytes:
-    """Ajusta a imagem para caber em um canvas fixo e retorna PNG.
+    Args:
+        data (bytes): Imagem codificada (JPEG ou PNG), como sai de get_thumb.
+
+    Returns:
+        str: ``data:image/...;base64,...``
+    """
+
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        mime = "image/png"
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        mime = "image/webp"
+    else:
+        mime = "image/jpeg"
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+def thumb_into_box(img: Image.Image, box_w: int = 240, box_h: int = 320, bg=None,
+                   fmt: str = "PNG") -> bytes:
+    """Ajusta a imagem para caber em um canvas fixo e retorna PNG, JPEG ou WebP.
 
     Se 'bg' não for definido, gera PNG RGBA com fundo transparente, permitindo
     que o tema do Streamlit apareça atrás (ótimo para dark mode).
     Se 'bg' for (R,G,B), usa canvas RGB sólido.
+    JPEG não tem alfa: só é usado com 'bg' sólido (sem 'bg', cai para WebP,
+    que mantém o alfa e codifica bem mais rápido que PNG). WebP funciona nos
+    dois casos; PNG só quando pedido explicitamente.
+
+    Atenção: imagens maiores que o box são reduzidas IN-PLACE (Image.thumbnail);
+    passe uma cópia se o original ainda for usado.
 
     Args:
         img (PIL.Image.Image): Imagem a encaixar.
         box_w (int): Largura do canvas (px).
         box_h (int): Altura do canvas (px).
         bg (tuple | None): Fundo sólido RGB ou None para transparência.
+        fmt (str): "PNG", "JPEG" ou "WEBP".
 
     Returns:
-        bytes: PNG exportado (preserva alfa quando RGBA).
+        bytes: Imagem exportada (PNG/WebP preservam alfa quando RGBA).
     """
 
     # 1) Redimensiona proporcionalmente para caber no retângulo interno (com pequena margem)
     inner_w, inner_h = box_w - 8, box_h - 8
-    fitted = ImageOps.contain(img, (inner_w, inner_h), method=RESAMPLE_LANCZOS)
+    if img.width > inner_w or img.height > inner_h:
+        # redução in-place: só aloca o buffer final
+        img.thumbnail((inner_w, inner_h), resample=PREVIEW_RESAMPLE)
+        fitted = img
+    else:
+        # menor que o box: contain amplia (thumbnail só reduz)
+        fitted = ImageOps.contain(img, (inner_w, inner_h), method=PREVIEW_RESAMPLE)
 
     # 2) Canvas de saída:
     #    - Se 'bg' não for passado -> RGBA TRANSPARENTE (deixa o tema do Streamlit aparecer)
     #    - Se 'bg' existir (ex.: (240,240,240)) -> usa RGB sólido
+    # 3) Centraliza
+    x = (box_w - fitted.width) // 2
+    y = (box_h - fitted.height) // 2
+
     if bg is None:
         canvas = Image.new("RGBA", (box_w, box_h), (0, 0, 0, 0))  # totalmente transparente
-        # garante que a imagem colada tenha alfa (para usar como máscara)
-        fitted_rgba = fitted.convert("RGBA")
+        # 4) Fundo 100% transparente: não há o que misturar, então é cópia direta
+        #    (sem máscara) — o alfa da imagem segue intacto, bordas suaves inclusive
+        canvas.paste(fitted.convert("RGBA"), (x, y))
     else:
         canvas = Image.new("RGB", (box_w, box_h), bg)
-        fitted_rgba = fitted.convert("RGBA")
-
-    # 3) Centraliza
-    x = (box_w - fitted_rgba.width) // 2
-    y = (box_h - fitted_rgba.height) // 2
-    # 4) Cola usando a própria imagem como máscara (preserva bordas suaves)
-    canvas.paste(fitted_rgba, (x, y), fitted_rgba)
-
-    # 5) Exporta como PNG (mantém transparência quando RGBA)
+        if fitted.mode in ("RGB", "L"):
+            # opaca (caso dos previews): cópia direta, sem RGBA + máscara
+            canvas.paste(fitted, (x, y))
+        else:
+            fitted_rgba = fitted.convert("RGBA")
+            canvas.paste(fitted_rgba, (x, y), fitted_rgba)
+
+    # 5) Exporta: JPEG (canvas RGB), WebP (também p/ JPEG pedido em canvas RGBA) ou PNG
+    #    sem optimize/progressive: thumbnail é efêmero, vale mais a velocidade
     buf = io.BytesIO()
-    canvas.save(buf, format="PNG", optimize=True)
+    if fmt.upper() == "JPEG" and canvas.mode == "RGB":
+        canvas.save(buf, format="JPEG", quality=PREVIEW_JPEG_Q, optimize=False, progressive=False)
+    elif fmt.upper() in ("WEBP", "JPEG"):
+        # WebP aceita alfa: serve tanto para o canvas RGB quanto para o RGBA; method=0 = encode rápido
+        canvas.save(buf, format="WEBP", quality=PREVIEW_WEBP_Q, method=0)
+    else:
+        canvas.save(buf, format="PNG", compress_level=1)
     return buf.getvalue()
 
 
@@ -381,31 +775,90 @@ def thumb_into_box(img: Image.Image, box_w: int = 240, box_h: int = 320, bg=None
 
 # --- Helper: aplica uma nova ordem (permutação) às listas de estado por PÁGINA ---
 def reorder_page_state(new_order_idx: list[int]) -> None:
-    """Aplica uma nova permutação ao estado por PÁGINA no session_state.
+    """Aplica uma nova permutação à ordem exibida das páginas.
 
-    Reordena de forma consistente:
-    - pages_flat
-    - keep_map
-    - rot_map
-    - level_page
+    As listas por página (pages_flat, keep_map, rot_map, level_page) ficam
+    fixas, indexadas pelo índice-base; só a indireção
+    ``st.session_state.order`` (posição -> índice-base) é permutada.
 
     Args:
-        new_order_idx (list[int]): Permutação 0-based com o mesmo comprimento
-            das listas de estado.
+        new_order_idx (list[int] | np.ndarray): Permutação 0-based das
+            POSIÇÕES atuais, com o mesmo comprimento de ``order``.
 
     Returns:
         None
     """
 
-    pf = st.session_state.pages_flat
-    km = st.session_state.keep_map
+    order = st.session_state.order
+    # ints Python (keys de widget e índices); ndarray vira lista 1x, em C
+    perm = new_order_idx.tolist() if isinstance(new_order_idx, np.ndarray) else list(new_order_idx)
+    if not perm or len(perm) != len(order):
+        return  # nada a fazer / ordem inválida
+
+    if len(perm) == 1:
+        return  # permutação de 1 item é a identidade (e itemgetter devolveria escalar)
+    # itemgetter com vários índices faz o gather em C, sem converter 'order' para array
+    st.session_state.order = list(itemgetter(*perm)(order))
+
+
+def swap_pages(i: int, j: int) -> None:
+    """Callback de ↑/↓: troca as páginas nas posições ``i`` e ``j``.
+
+    Usado como ``on_click`` — roda antes do rerun disparado pelo próprio
+    widget, então dispensa ``st.rerun()`` explícito.
+
+    Args:
+        i (int): Posição atual da página.
+        j (int): Posição de destino (vizinha).
+
+    Returns:
+        None
+    """
+    order = st.session_state.order
+    if 0 <= i < len(order) and 0 <= j < len(order):
+        order[i], order[j] = order[j], order[i]  # só a indireção; estado fica onde está
+
+
+def rotate_page(i: int) -> None:
+    """Callback de "Girar ↻": avança a rotação da página ``i`` em 90°.
+
+    A miniatura nova sai do raster base (``_pix_cache``), sem invalidar cache.
+
+    Args:
+        i (int): Índice-base da página (``order[pos]``), não a posição.
+
+    Returns:
+        None
+    """
     rm = st.session_state.rot_map
-    lv = st.session_state.level_page
+    rm[i] = (rm[i] + 90) % 360
 
-    if not new_order_idx or len(new_order_idx) != len(pf):
-        return  # nada a fazer / ordem inválida
 
-    st.session_state.pages_flat = [pf[i] for i in new_order_idx]
-    st.session_state.keep_map   = [km[i] for i in new_order_idx]
-    st.session_state.rot_map    = [rm[i] for i in new_order_idx]
-    st.session_state.level_page = [lv[i] for i in new_order_idx]
+def set_keep(i: int) -> None:
+    """Callback do checkbox "Manter": copia o valor do widget para keep_map.
+
+    Args:
+        i (int): Índice-base da página (o widget usa a key ``keep_u_{i}``).
+
+    Returns:
+        None
+    """
+    st.session_state.keep_map[i] = bool(st.session_state.get(f"keep_u_{i}", True))
+
+
+def set_level(i: int, key: str, val_map: Dict[str, str]) -> None:
+    """Callback da compressão individual: copia o nível do widget para level_page.
+
+    O badge "Personalizado" e o seletor global ficam fora do fragmento do
+    grid; ``_levels_changed`` pede ao fragmento um rerun completo.
+
+    Args:
+        i (int): Índice-base da página.
+        key (str): Key do selectbox da página.
+        val_map (Dict[str, str]): Rótulo -> nível interno do conjunto em uso.
+
+    Returns:
+        None
+    """
+    st.session_state.level_page[i] = val_map[st.session_state[key]]
+    st.session_state._levels_changed = True
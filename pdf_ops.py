@@ -14,11 +14,20 @@ Todas as funções trabalham com bytes e metadados simples.
 
 from __future__ import annotations
 
+import functools
+import hashlib
 import io
-from typing import Dict, Iterable, List, Tuple, cast, Any
+import math
+import multiprocessing as mp
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import IO, Callable, Dict, Iterable, List, Tuple, cast, Any
 
 import img2pdf
 import fitz  # PyMuPDF
+import numpy as np
 from PIL import Image
 # Pillow 9 vs 10+: constante de reamostragem
 try:
@@ -27,15 +36,123 @@ except AttributeError:
     # Pillow < 10 mantém o alias antigo
     RESAMPLE_LANCZOS = Image.LANCZOS  # pyright: ignore[reportAttributeAccessIssue]
 
-# retrocompatibilidade
 
-from pypdf import PdfReader, PdfWriter
-
-from app_helpers import LEVELS
+# libjpeg-turbo (opcional): encode SIMD direto do buffer do pixmap.
+# Sem o pacote (ou sem a lib nativa), as páginas saem pelo libjpeg-turbo
+# embutido no Pillow (ver _encode_jpeg).
+try:
+    from turbojpeg import (  # pyright: ignore[reportMissingImports]
+        TurboJPEG, TJPF_RGB, TJPF_GRAY, TJSAMP_GRAY, TJSAMP_444, TJSAMP_422, TJSAMP_420,
+        TJFLAG_PROGRESSIVE,
+    )
+    _TJ = TurboJPEG()
+    # subsampling no código do Pillow (0=4:4:4, 1=4:2:2, 2=4:2:0) -> libjpeg-turbo
+    _TJ_SUBSAMP = {0: TJSAMP_444, 1: TJSAMP_422, 2: TJSAMP_420}
+except Exception:
+    _TJ = None
+
+# Mapa de níveis internos -> parâmetros da engine (a UI reexporta via
+# app_helpers; fica aqui para os processos worker não importarem o Streamlit)
+LEVELS: Dict[str, dict] = {
+    "none": {"mode": "none", "dpi": None, "jpg_q": None},
+    # "smart": rasteriza apenas páginas "imagem-only" (detectadas), preservando vetores/texto
+    "min":  {"mode": "smart", "dpi": 200, "jpg_q": 85},
+    # "all": rasteriza todas as páginas
+    "med":  {"mode": "all",   "dpi": 150, "jpg_q": 70},
+    "max":  {"mode": "all",   "dpi": 110, "jpg_q": 50},
+}
+
+# Paralelismo por páginas (processos: o PyMuPDF não libera o GIL e
+# fitz.Document não é thread-safe). Abaixo do mínimo, o custo de subir os
+# processos 'spawn' não compensa e tudo roda em série.
+PARALLEL_MIN_PAGES = 16
+PARALLEL_MAX_WORKERS = 4
+# merge_pages: páginas por tarefa ao adiantar candidatos; cada lote (até
+# PARALLEL_MAX_WORKERS tarefas) é consumido e inserido antes do próximo
+PARALLEL_BATCH_PAGES = 10
+# merge_items: mínimo de bytes a comprimir para dividir os itens entre
+# processos (medido: ~2 MB de itens comprimem em ~0,6 s, o mesmo que subir o pool)
+PARALLEL_MIN_ITEM_BYTES = 8 * 1024 * 1024
+
+# Piso de bytes/pixel de um JPEG de página (medido: página em branco fica em
+# ~0,012 B/px de q50 a q85; páginas reais, 0,06+). Se nem o piso cabe no
+# tamanho original, rasterizar tudo não tem como ganhar.
+JPEG_MIN_BYTES_PER_PX = 0.01
+
+# Opções de escrita dos PDFs FINAIS (merge/split). use_objstms agrupa os
+# objetos pequenos em object streams comprimidos: arquivo menor, mesmo custo.
+PDF_WRITE_OPTS: Dict[str, Any] = {"garbage": 4, "deflate": True, "clean": True, "use_objstms": 1}
+
+# Memo das estimativas por conteúdo: chave = (função, blake2b dos bytes,
+# tamanho, parâmetros) -> int. Guarda só o digest e o número, nunca o arquivo.
+EST_MEMO_MAX = 256
+_EST_MEMO: "OrderedDict[tuple, int]" = OrderedDict()
+_EST_MEMO_LOCK = threading.Lock()
+
+# Resultado da busca de qualidade das imagens (q, flags do encoder, passos de
+# downscale), por (blake2b, tamanho, nível): a estimativa e a conversão real
+# repetem o mesmo encode 1x em vez de refazer a busca. Só números, nunca bytes.
+_BAND_MEMO: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+
+# Candidatos rasterizados (PDF 1-pág) guardados no próprio Document entre a
+# estimativa e o merge; teto de bytes por documento (LRU).
+CAND_MEMO_MAX_BYTES = 32 * 1024 * 1024
+
+
+def _band_key(img_bytes: bytes, level: str) -> tuple:
+    """Chave do _BAND_MEMO para a imagem 'img_bytes' no nível 'level'."""
+    return (hashlib.blake2b(img_bytes, digest_size=16).digest(), len(img_bytes), level)
+
+
+def _memo_by_digest(fn):
+    """
+    Decorator: memoiza fn(data, *params) -> int pelo hash do conteúdo.
+    Só atua quando 'data' é bytes; fitz.Document passa direto para fn.
+    """
+    @functools.wraps(fn)
+    def wrapper(data, *params):
+        if not isinstance(data, (bytes, bytearray)):
+            return fn(data, *params)
+        key = (fn.__name__, hashlib.blake2b(data, digest_size=16).digest(), len(data), *params)
+        with _EST_MEMO_LOCK:
+            hit = _EST_MEMO.get(key)
+            if hit is not None:
+                _EST_MEMO.move_to_end(key)
+                return hit
+        val = fn(data, *params)
+        with _EST_MEMO_LOCK:
+            _EST_MEMO[key] = val
+            while len(_EST_MEMO) > EST_MEMO_MAX:
+                _EST_MEMO.popitem(last=False)
+        return val
+    return wrapper
 
 # ===========================
 #   HELPER: JPEG COM QUALIDADE AJUSTÁVEL (sem novas deps)
 # ===========================
+def _first_ok(n: int, ok: Callable[[int], bool]) -> int:
+    """
+    Menor i em [0, n] com ok(i) True, supondo ok monotônico (False... True).
+    Busca exponencial + binária: 1 chamada quando ok(0), ~2·log2(i) no pior caso.
+    Se nenhum i < n satisfaz, devolve n (sem testar n).
+    """
+    if n <= 0 or ok(0):
+        return 0
+    lo, step = 0, 1  # invariante: ok(lo) é False
+    while True:
+        hi = min(lo + step, n)
+        if hi == n or ok(hi):
+            break
+        lo, step = hi, step * 2
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if ok(mid):
+            hi = mid
+        else:
+            lo = mid
+    return hi
+
+
 def _jpeg_bytes_with_band(
     img: Image.Image,
     q_start: int,
@@ -44,24 +161,36 @@ def _jpeg_bytes_with_band(
     baseline_len: int,
     q_floor: int = 40,
     subsamp_default: int | None = None,
+    memo_key: tuple | None = None,
 ) -> tuple[bytes, bool]:
     """
     Re-encode em JPEG ajustando qualidade para manter o tamanho DENTRO de uma faixa
     medida contra 'baseline_len' (tamanho do PDF-base do original).
     Retorna (jpeg_bytes, reached_floor) onde reached_floor=True indica que o piso foi atingido.
-    """
-    # IMPORT LOCAL para não alterar seus imports globais
-    import math
 
+    Com 'memo_key', o resultado da busca fica em _BAND_MEMO; numa próxima chamada
+    com a mesma chave (mesma imagem de entrada), repete só os downscales e o
+    encode final — mesmos bytes, sem a busca.
+    """
     # sempre RGB para JPEG
     if img.mode not in ("RGB",):
         img = img.convert("RGB")
 
     def _enc(qv: int, subsamp: int | None = None,
              optimize: bool = True, progressive: bool = True) -> bytes:
+        use_sub = subsamp if subsamp is not None else subsamp_default
+        if _TJ is not None:
+            # libjpeg-turbo direto do buffer (sem save()/BytesIO a cada passo da busca);
+            # progressivo já sai com Huffman otimizado; sem subsampling explícito = 4:2:0,
+            # o mesmo padrão do Pillow
+            try:
+                return _TJ.encode(np.asarray(img), quality=int(qv), pixel_format=TJPF_RGB,
+                                  jpeg_subsample=_TJ_SUBSAMP.get(use_sub, TJSAMP_420),
+                                  flags=TJFLAG_PROGRESSIVE if progressive else 0)
+            except Exception:
+                pass  # cai no Pillow
         buf = io.BytesIO()
         try:
-            use_sub = subsamp if subsamp is not None else subsamp_default
             if use_sub is None:
                 img.save(buf, "JPEG", quality=int(qv), optimize=optimize, progressive=progressive)
             else:
@@ -71,15 +200,39 @@ def _jpeg_bytes_with_band(
             img.save(buf, "JPEG", quality=int(qv), optimize=optimize, progressive=progressive)
         return buf.getvalue()
 
+    if memo_key is not None:
+        with _EST_MEMO_LOCK:
+            rec = _BAND_MEMO.get(memo_key)
+            if rec is not None:
+                _BAND_MEMO.move_to_end(memo_key)
+        if rec is not None:
+            for wh in rec["steps"]:
+                img = img.resize(wh, RESAMPLE_LANCZOS)
+            return _enc(rec["q"], *rec["enc"]), rec["reached"]
+
+    # cache q -> bytes: a busca nunca re-encoda uma qualidade já medida
+    memo: Dict[int, bytes] = {}
+    steps: List[Tuple[int, int]] = []  # downscales guiados, na ordem
+    enc_args: tuple = ()                # (subsamp, optimize, progressive) se != padrão
+
+    def _at(qv: int) -> bytes:
+        if qv not in memo:
+            memo[qv] = _enc(qv)
+        return memo[qv]
+
     q = max(1, min(int(q_start), 95))
-    out = _enc(q)
+    out = _at(q)
 
     # 1) teto (compressão mínima desejada)
+    # mesma grade de antes (q, q-3, q-6, ... até passar do piso), mas com busca
+    # exponencial/binária em vez de descer de 3 em 3 encodando cada passo
     if keep_max is not None:
         ceil_len = int(baseline_len * keep_max)
-        while len(out) > ceil_len and q > q_floor:
-            q -= 3
-            out = _enc(q)
+        q0 = q
+        n = max(0, -(-(q0 - q_floor) // 3))
+        k = _first_ok(n, lambda i: len(_at(q0 - 3 * i)) <= ceil_len)
+        q = q0 - 3 * k
+        out = _at(q)
 
         # 1a) Se ainda não atingiu o teto no piso de qualidade, tenta downscale guiado (apenas se q_floor <= 32)
         if len(out) > ceil_len and q <= q_floor and q_floor <= 32:
@@ -90,29 +243,39 @@ def _jpeg_bytes_with_band(
             while len(out) > ceil_len and max(w, h) > MIN_LONG_SIDE:
                 w = max(1, int(w * scale)); h = max(1, int(h * scale))
                 img = img.resize((w, h), RESAMPLE_LANCZOS)
+                steps.append((w, h))
                 out = _enc(q)  # mantém 'q' atual
+            memo = {q: out}  # imagem mudou: medidas antigas não valem mais
 
     # 2) piso (evitar secar demais)
     reached_floor = True
     if keep_min is not None:
         floor_len = int(baseline_len * keep_min)
-        while len(out) < floor_len and q < 95:
-            q += 3
-            out = _enc(q)
+        q0 = q
+        n = max(0, -(-(95 - q0) // 3))
+        j = _first_ok(n, lambda i: len(_at(q0 + 3 * i)) >= floor_len)
+        q = q0 + 3 * j
+        out = _at(q)
 
         if len(out) < floor_len:
             # tentar “engordar”: 4:4:4 + quality 100
             out2 = _enc(100, subsamp=0)
             if len(out2) > len(out):
-                out = out2
+                out, q, enc_args = out2, 100, (0,)
             if len(out) < floor_len:
                 # último recurso: sem optimize/progressive
                 out3 = _enc(100, subsamp=0, optimize=False, progressive=False)
                 if len(out3) > len(out):
-                    out = out3
+                    out, q, enc_args = out3, 100, (0, False, False)
 
         reached_floor = (len(out) >= floor_len)
 
+    if memo_key is not None:
+        with _EST_MEMO_LOCK:
+            _BAND_MEMO[memo_key] = {"q": q, "enc": enc_args, "steps": tuple(steps), "reached": reached_floor}
+            while len(_BAND_MEMO) > EST_MEMO_MAX:
+                _BAND_MEMO.popitem(last=False)
+
     return out, reached_floor
 
 
@@ -133,16 +296,191 @@ def _is_image_only(page: "fitz.Page") -> bool:
         bool: True se não houver texto nem vetores; False caso contrário.
     """
     p = cast(Any, page)
+    # memo no próprio Document (morre com ele; id() poderia ser reaproveitado):
+    # estimativa e merge usam o mesmo doc da sessão e classificam cada página 1x
+    memo = _doc_memo(getattr(p, "parent", None), "_image_only_memo", dict)
+    if memo is not None and p.number in memo:
+        return memo[p.number]
+    result = _classify_image_only(p)
+    if memo is not None:
+        memo[p.number] = result
+    return result
+
+
+def _doc_memo(doc: Any, attr: str, factory: Callable[[], Any]) -> Any:
+    """
+    Memo guardado como atributo do próprio fitz.Document (criado na 1ª vez,
+    morre com o doc). None quando não dá para anexar (sem doc).
+    """
+    memo = getattr(doc, attr, None)
+    if memo is None and doc is not None:
+        memo = factory()
+        try:
+            setattr(doc, attr, memo)
+        except Exception:
+            memo = None
+    return memo
+
+
+def _classify_image_only(p: Any) -> bool:
+    """Núcleo de _is_image_only (sem memo)."""
+    # vetores primeiro (mais barato) e com curto-circuito: se houver, nem extrai texto.
+    # get_cdrawings devolve os paths crus (sem montar objetos Python de cada item)
+    try:
+        draw = getattr(p, "get_cdrawings", None) or p.get_drawings
+        if len(draw()) > 0:                             # pyright: ignore[reportAttributeAccessIssue]
+            return False
+    except Exception:
+        pass
     try:
         has_text = bool(p.get_text("text"))             # pyright: ignore[reportAttributeAccessIssue]
     except Exception:
         has_text = False
+    return not has_text
+
+
+def _open_pdf(pdf: bytes | fitz.Document) -> tuple[fitz.Document, bool]:
+    """
+    Abre 'pdf' como fitz.Document, ou reaproveita um Document já aberto.
+    Retorna (doc, owned): owned=True indica que quem chamou deve fechar o doc.
+    """
+    if isinstance(pdf, fitz.Document):
+        return pdf, False
+    return fitz.open("pdf", pdf), True
+
+
+# Escada do guard-rail: cada nível compara o base com os candidatos até ele
+# (max ≤ med ≤ min ≤ base).
+_GUARDRAIL_LADDER: Dict[str, Tuple[str, ...]] = {
+    "min": ("min",),
+    "med": ("min", "med"),
+    "max": ("min", "med", "max"),
+}
+
+
+def _guardrail_levels(level: str) -> List[str]:
+    """
+    Candidatos que de fato precisam ser gerados para 'level'.
+
+    Percorre a escada do nível mais forte para o mais fraco e pula o nível
+    dominado: mesmo modo (ou o mais forte rasteriza tudo) com DPI e qualidade
+    >= aos de um nível já incluído. Esse JPEG só pode sair maior (mais pixels,
+    mais qualidade), então não muda o mínimo — e economiza a rasterização.
+    """
+    keep: List[str] = []
+    for lk in reversed(_GUARDRAIL_LADDER.get(level, ())):
+        lo = LEVELS[lk]
+        dominated = any(
+            (hi["mode"] == "all" or hi["mode"] == lo["mode"])
+            and (lo["dpi"] or 150) >= (hi["dpi"] or 150)
+            and (lo["jpg_q"] or 75) >= (hi["jpg_q"] or 75)
+            for hi in (LEVELS[k] for k in keep)
+        )
+        if not dominated:
+            keep.append(lk)
+    return keep[::-1]
+
+
+def _cand_memo_key(page_no: int, level_key: str) -> tuple:
+    """Chave do memo de candidatos: (página, dpi, qualidade) do nível."""
+    pr = LEVELS.get(level_key, LEVELS["none"])
+    return (page_no, int(pr["dpi"] or 150), int(pr["jpg_q"] or 75))
+
+
+def _render_page_candidates(pdf: bytes | fitz.Document, items: List[Tuple[int, str]]) -> List[bytes | None]:
+    """Worker: _page_candidate para cada (página, nível) de UM PDF, na ordem."""
+    src, owned = _open_pdf(pdf)
     try:
-        has_vectors = len(p.get_drawings()) > 0         # pyright: ignore[reportAttributeAccessIssue]
+        return [_page_candidate(src.load_page(pi), lk) for pi, lk in items]
+    finally:
+        if owned:
+            src.close()
+
+
+def _page_candidate(pg: "fitz.Page", level_key: str) -> bytes | None:
+    """
+    Candidato de UMA página no nível 'level_key': PDF 1-pág com a página
+    rasterizada em JPEG, ou None quando o nível mantém a página como está
+    (none, ou smart numa página com texto/vetores).
+
+    Memo no próprio Document (morre com ele): a estimativa e o merge da sessão
+    usam o mesmo doc, e o merge reaproveita o que a estimativa já rasterizou.
+    """
+    pr = LEVELS.get(level_key, LEVELS["none"])
+    md = pr["mode"]; dp = int(pr["dpi"] or 150); jq = int(pr["jpg_q"] or 75)
+    if md == "none":
+        return None
+    if md == "smart" and not _is_image_only(pg):
+        return None
+
+    p = cast(Any, pg)
+    memo: "OrderedDict[tuple, bytes] | None" = _doc_memo(getattr(p, "parent", None), "_cand_memo", OrderedDict)
+    key = _cand_memo_key(p.number, level_key)
+    if memo is not None and key in memo:
+        memo.move_to_end(key)
+        return memo[key]
+
+    dpi_eff = _cap_dpi_for_page(pg, dp)
+    mat = fitz.Matrix(dpi_eff/72.0, dpi_eff/72.0)
+    pix = p.get_pixmap(matrix=mat, alpha=False, colorspace=fitz.csRGB)
+    jpg_b = _encode_jpeg(pix, jq)
+    del pix
+    try:
+        out = _jpeg_page_pdf(pg.rect, jpg_b)
     except Exception:
-        has_vectors = False
-    return (not has_text) and (not has_vectors)
-def _estimate_pdf_page_len_guardrail(pdf_bytes: bytes, page_idx: int, level: str) -> int:
+        # raríssimo: devolve o JPEG solto (quem chama decide o fallback); não memoiza
+        return jpg_b
+
+    if memo is not None:
+        _cand_memo_put(memo, key, out)
+    return out
+
+
+def _cand_memo_put(memo: "OrderedDict[tuple, bytes]", key: tuple, cand: bytes) -> None:
+    """Guarda o candidato e descarta os mais antigos acima de CAND_MEMO_MAX_BYTES."""
+    memo[key] = cand
+    memo.move_to_end(key)
+    total = sum(len(v) for v in memo.values())
+    while total > CAND_MEMO_MAX_BYTES and len(memo) > 1:
+        total -= len(memo.popitem(last=False)[1])
+
+
+def _page_guardrail_lens(src: fitz.Document, page_idx: int, level: str) -> Tuple[int, int]:
+    """
+    Núcleo do guard-rail para UMA página de um documento já aberto.
+
+    Retorna (base_len, escolhido): base_len é o PDF 1:1 da página (a estimativa
+    do nível 'none'); escolhido é o menor entre base e candidatos de 'level'.
+    """
+    if page_idx < 0 or page_idx >= src.page_count:
+        return 0, 0
+
+    # 1) base: a página 1:1 como PDF solo
+    base_doc = fitz.open()
+    base_doc.insert_pdf(src, from_page=page_idx, to_page=page_idx)
+    base_bytes = base_doc.write(garbage=4, deflate=True, clean=True)  # pyright: ignore[reportArgumentType]
+    base_doc.close()
+    base_len = len(base_bytes)
+
+    if level not in ("min", "med", "max"):
+        return base_len, base_len
+
+    # 2) helper de candidato
+    pg = src.load_page(page_idx)
+
+    def _cand_len(level_key: str) -> int:
+        cand = _page_candidate(pg, level_key)  # o mesmo candidato do merge_pages
+        if cand is None:
+            return base_len
+        if not cand.startswith(b"%PDF"):
+            # raro: se falhar o wrapper em PDF, usa JPEG como proxy (+1024 p/ aproximar)
+            return len(cand) + 1024
+        return len(cand)
+
+    return base_len, min([base_len] + [_cand_len(k) for k in _guardrail_levels(level)])
+
+
+def _estimate_pdf_page_len_guardrail(pdf_bytes: bytes | fitz.Document, page_idx: int, level: str) -> int:
     """
     Estima o tamanho *escolhido* pelo guard-rail para UMA página de PDF.
 
@@ -150,62 +488,201 @@ def _estimate_pdf_page_len_guardrail(pdf_bytes: bytes, page_idx: int, level: str
       - base_bytes = PDF 1:1 dessa página
       - candidatos conforme 'level' e LEVELS
       - compara base vs candidatos e retorna o menor len(...)
+
+    Aceita bytes ou um fitz.Document já aberto (não é fechado aqui).
     """
+    src, owned = None, False
     try:
-        src = fitz.open("pdf", pdf_bytes)
-        if page_idx < 0 or page_idx >= src.page_count:
-            src.close()
-            return 0
+        src, owned = _open_pdf(pdf_bytes)
+        return _page_guardrail_lens(src, page_idx, level)[1]
+    except Exception:
+        return len(pdf_bytes) if isinstance(pdf_bytes, (bytes, bytearray)) else 0
+    finally:
+        if owned and src is not None:
+            try:
+                src.close()
+            except Exception:
+                pass
 
-        # 1) base: a página 1:1 como PDF solo
-        base_doc = fitz.open()
-        base_doc.insert_pdf(src, from_page=page_idx, to_page=page_idx)
-        base_bytes = base_doc.write(garbage=4, deflate=True, clean=True)  # pyright: ignore[reportArgumentType]
-        base_doc.close()
-        base_len = len(base_bytes)
 
-        # 2) helper de candidato
-        params = LEVELS.get(level or "none", LEVELS["none"])
-        mode = params["mode"]; dpi = int(params["dpi"] or 150); jpg_q = int(params["jpg_q"] or 75)
-        pg = src.load_page(page_idx)
+def estimate_pdf_pages_sizes(
+    pdf_bytes: bytes | fitz.Document,
+    page_indices: Iterable[int],
+    levels: str | Iterable[str],
+) -> List[Tuple[int, int]]:
+    """Estima várias páginas do MESMO PDF numa única passada.
 
-        def _cand_len(level_key: str) -> int:
-            pr = LEVELS.get(level_key, LEVELS["none"])
-            md = pr["mode"]; dp = int(pr["dpi"] or 150); jq = int(pr["jpg_q"] or 75)
+    Abre o documento uma vez (ou reaproveita o Document recebido) e, por
+    página, gera o PDF 1:1 uma só vez: ele serve de estimativa do nível
+    'none' e de base do guard-rail do nível pedido.
 
-            if md == "none":
-                return base_len
+    Args:
+        pdf_bytes: Bytes do PDF ou fitz.Document já aberto (não é fechado aqui).
+        page_indices: Índices de página (0-based).
+        levels: Um nível para todas as páginas ou um nível por página.
 
-            if md == "smart" and not _is_image_only(pg):
-                return base_len
+    Returns:
+        list[tuple[int, int]]: (tamanho 'none', tamanho no nível) por página,
+        na mesma ordem de page_indices.
+    """
+    pages = list(page_indices)
+    lvls = [levels] * len(pages) if isinstance(levels, str) else list(levels)
+    fallback = len(pdf_bytes) if isinstance(pdf_bytes, (bytes, bytearray)) else 0
 
-            dpi_eff = _cap_dpi_for_page(pg, dp)  # usa o mesmo cap do merge
-            mat = fitz.Matrix(dpi_eff/72.0, dpi_eff/72.0)
-            pix = pg.get_pixmap(matrix=mat, alpha=False, colorspace=fitz.csRGB)  # pyright: ignore[reportAttributeAccessIssue]
-            jpg_b = pix.tobytes("jpeg", jpg_quality=jq)
-            del pix
+    src, owned = None, False
+    try:
+        src, owned = _open_pdf(pdf_bytes)
+    except Exception:
+        return [(fallback, fallback)] * len(pages)
+    try:
+        out: List[Tuple[int, int]] = []
+        for pi, lvl in zip(pages, lvls):
             try:
-                pdf1 = cast(bytes, img2pdf.convert(jpg_b))  # embrulha em PDF 1-pag
-                return len(pdf1)
+                out.append(_page_guardrail_lens(src, pi, lvl))
             except Exception:
-                # raro: se falhar o wrapper em PDF, usa JPEG como proxy (+1024 p/ aproximar)
-                return len(jpg_b) + 1024
-
-        if level == "min":
-            return min(base_len, _cand_len("min"))
-        elif level == "med":
-            return min(base_len, _cand_len("min"), _cand_len("med"))
-        elif level == "max":
-            return min(base_len, _cand_len("min"), _cand_len("med"), _cand_len("max"))
-        else:
-            return base_len
-    except Exception:
-        return len(pdf_bytes)
+                out.append((fallback, fallback))
+        return out
     finally:
+        if owned:
+            try:
+                src.close()
+            except Exception:
+                pass
+
+def _downscale_max_side(im: Image.Image, max_side: int | None) -> Image.Image:
+    """
+    Reduz 'im' para caber em max_side (lado maior), com LANCZOS.
+    JPEG ainda não carregado usa draft(): o libjpeg decodifica já em 1/2, 1/4
+    ou 1/8 (nunca abaixo do alvo), e o LANCZOS roda num buffer bem menor.
+    Nos demais (PNG grande, JPEG sem draft), reducing_gap faz antes um
+    reduce() inteiro (média em blocos) até ~3× o alvo; o LANCZOS fica só
+    com o passo final.
+    """
+    if max_side is None:
+        return im
+    w, h = im.size
+    scale = min(max_side / max(w, h), 1.0)
+    if scale >= 1.0:
+        return im
+    target = (int(w * scale), int(h * scale))
+    if im.format == "JPEG":
         try:
-            src.close()
+            im.draft("RGB", target)
+        except Exception:
+            pass
+    return im.resize(target, RESAMPLE_LANCZOS, reducing_gap=3.0)
+
+
+def _encode_jpeg(pix: "fitz.Pixmap", jpg_q: int) -> bytes:
+    """
+    Codifica o pixmap (RGB ou cinza, sem alfa) em JPEG.
+
+    Mesmo formato que o pix.tobytes("jpeg") do MuPDF gerava (4:4:4,
+    progressivo, mesmas tabelas de quantização), mas pelo libjpeg-turbo:
+    PyTurboJPEG quando disponível, senão o que vem embutido no Pillow
+    (medido: 2–2,7× mais rápido que o encoder do MuPDF, tamanho ±0,1%).
+    pix.tobytes("jpeg") fica como último recurso.
+    """
+    if not pix.alpha and pix.n in (1, 3):
+        if _TJ is not None:
+            try:
+                # view sem cópia: o pixmap segue vivo até o fim do encode
+                arr = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+                if pix.n == 1:
+                    return _TJ.encode(arr, quality=jpg_q, pixel_format=TJPF_GRAY,
+                                      jpeg_subsample=TJSAMP_GRAY, flags=TJFLAG_PROGRESSIVE)
+                return _TJ.encode(arr, quality=jpg_q, pixel_format=TJPF_RGB,
+                                  jpeg_subsample=TJSAMP_444, flags=TJFLAG_PROGRESSIVE)
+            except Exception:
+                pass
+        try:
+            mode = "L" if pix.n == 1 else "RGB"
+            # frombuffer lê o buffer do pixmap sem copiar
+            im = Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride, 1)
+            buf = io.BytesIO()
+            im.save(buf, "JPEG", quality=int(jpg_q), subsampling=0, progressive=True)
+            return buf.getvalue()
         except Exception:
             pass
+    return pix.tobytes("jpeg", jpg_quality=jpg_q)
+
+
+def _add_jpeg_page(dst: fitz.Document, rect: "fitz.Rect", jpg_b: bytes) -> None:
+    """Acrescenta a 'dst' uma página do tamanho de 'rect' coberta pelo JPEG.
+
+    O stream JPEG entra como está (DCT), sem o parse/reescrita do img2pdf, e
+    a página mantém o tamanho da original (não depende do DPI do JPEG).
+    """
+    p = dst.new_page(width=rect.width, height=rect.height)
+    p.insert_image(p.rect, stream=jpg_b)
+
+
+def _jpeg_page_pdf(rect: "fitz.Rect", jpg_b: bytes) -> bytes:
+    """PDF de 1 página com o JPEG no tamanho de 'rect' (candidato do guard-rail)."""
+    one = fitz.open()
+    try:
+        _add_jpeg_page(one, rect, jpg_b)
+        return one.write(garbage=4, deflate=True)  # pyright: ignore[reportArgumentType]
+    finally:
+        one.close()
+
+
+def pool_workers(n_tasks: int) -> int:
+    """Nº de processos para 'n_tasks' tarefas independentes (1 = rodar em série)."""
+    return max(1, min(os.cpu_count() or 1, PARALLEL_MAX_WORKERS, n_tasks))
+
+
+def process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Pool de processos usado por todo o paralelismo do app (merge, compressão,
+    pré-aquecimento dos previews). 'spawn': não herda as threads do processo
+    pai (ex.: servidor do Streamlit); os workers ficam em pdf_ops, que não
+    importa o Streamlit, então cada processo sobe só com o motor.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"))
+
+
+def _parallel_pages(fn: Callable[..., list], pdf_bytes: bytes, pages: list, *args) -> list | None:
+    """
+    Roda fn(pdf_bytes, fatia_de_pages, *args) em processos e concatena os
+    resultados na ordem de 'pages'. 'fn' precisa ser função de módulo
+    (picklable) e abrir o próprio documento.
+
+    Devolve None quando não vale a pena (1 CPU, poucas páginas) ou se algo
+    falhar — o chamador segue pelo caminho em série.
+    """
+    workers = pool_workers(len(pages))
+    if workers < 2 or len(pages) < PARALLEL_MIN_PAGES:
+        return None
+    size = math.ceil(len(pages) / workers)
+    chunks = [pages[k:k + size] for k in range(0, len(pages), size)]
+    try:
+        with process_pool(workers) as ex:
+            parts = list(ex.map(fn, [pdf_bytes] * len(chunks), chunks,
+                                *[[a] * len(chunks) for a in args]))
+    except Exception:
+        return None
+    return [x for part in parts for x in part]
+
+
+def _render_pages_jpeg(pdf: bytes | fitz.Document, pages: List[int], dpi: int, jpg_q: int) -> List[bytes]:
+    """Worker: rasteriza as páginas pedidas de UM PDF e devolve os JPEGs, na ordem.
+
+    Nos processos recebe bytes (e abre o próprio documento); no caminho em
+    série recebe o Document que o chamador já abriu (não é fechado aqui).
+    """
+    src, owned = _open_pdf(pdf)
+    try:
+        out = []
+        for i in pages:
+            pix = src.load_page(i).get_pixmap(dpi=dpi, alpha=False)  # pyright: ignore[reportAttributeAccessIssue]
+            out.append(_encode_jpeg(pix, jpg_q))
+            del pix
+        return out
+    finally:
+        if owned:
+            src.close()
+
 
 def _cap_dpi_for_page(page: "fitz.Page", target_dpi: int) -> int:
     """
@@ -226,6 +703,7 @@ def _cap_dpi_for_page(page: "fitz.Page", target_dpi: int) -> int:
         return int(target_dpi)
 
 
+@_memo_by_digest
 def estimate_pdf_size(pdf_bytes: bytes, level: str) -> int:
     """Estima o tamanho final de um PDF após aplicar um nível de compressão.
 
@@ -236,8 +714,6 @@ def estimate_pdf_size(pdf_bytes: bytes, level: str) -> int:
     """
     try:
         src = fitz.open("pdf", pdf_bytes)
-        pages = src.page_count
-        src.close()
     except Exception:
         return len(pdf_bytes)
 
@@ -245,24 +721,50 @@ def estimate_pdf_size(pdf_bytes: bytes, level: str) -> int:
     EST_OVERHEAD_DOC = 2048
     EST_OVERHEAD_PER_PAGE = 512
 
-    total = 0
-    for i in range(pages):
-        total += _estimate_pdf_page_len_guardrail(pdf_bytes, i, level)
+    try:
+        pages = src.page_count
+        sizes = _parallel_pages(estimate_pdf_pages_sizes, pdf_bytes, list(range(pages)), level)
+        if sizes is None:
+            sizes = estimate_pdf_pages_sizes(src, range(pages), level)
+        total = sum(after for _, after in sizes)
+    finally:
+        src.close()
 
     return max(0, total + EST_OVERHEAD_DOC + EST_OVERHEAD_PER_PAGE * pages)
 
 
-def estimate_pdf_page_size(pdf_bytes: bytes, page_idx: int, level: str) -> int:
+@_memo_by_digest
+def estimate_pdf_page_size(pdf_bytes: bytes | fitz.Document, page_idx: int, level: str) -> int:
     """Estima o tamanho de UMA página após aplicar um nível.
 
     Agora usa o MESMO guard-rail do merge_pages (base vs candidatos).
+    Aceita bytes ou um fitz.Document já aberto (ex.: cache da sessão).
     """
     return _estimate_pdf_page_len_guardrail(pdf_bytes, page_idx, level)
 
 
-def estimate_image_pdf_size(img_bytes: bytes, level: str) -> int:
-    """Estima o tamanho do PDF (1 página) gerado a partir de uma imagem, mirando a FAIXA vs PDF-base."""
+# Regras calibradas por nível (ajuste fino livre), usadas pela estimativa E
+# pela conversão real (image_to_pdf_bytes) — uma tabela só, já que as duas
+# compartilham a busca de qualidade no _BAND_MEMO:
+# nível -> (q_start, keep_min, keep_max, max_side, q_floor, subsampling)
+_IMG_EST_RULES: Dict[str, Tuple[int, float | None, float, int | None, int, int | None]] = {
+    # <= 75% do baseline (≥25% de redução), >= 65% (≤35% de redução)
+    "min": (88, 0.65, 0.75, None, 45, None),
+    # <= 48% → ≥52% de redução; >= 30% → ≤70% de redução; 4:2:0
+    "med": (75, 0.30, 0.48, 1280, 30, 2),
+    # <= 30% → ≥70% de redução; 4:2:0
+    "max": (65, None, 0.30, 2000, 24, 2),
+}
+
 
+def estimate_image_pdf_sizes(img_bytes: bytes, levels: Iterable[str]) -> Dict[str, int]:
+    """
+    Estima o tamanho do PDF (1 página) da imagem em VÁRIOS níveis de uma vez.
+    O PDF-base sai 1x; cada nível reduz a partir do original, como o
+    image_to_pdf_bytes, então a estimativa bate com o PDF gerado. O decode é
+    compartilhado, exceto em JPEG: draft() altera a imagem, então cada nível
+    reabre o arquivo (decode já reduzido pelo libjpeg).
+    """
     # PDF-base do original (baseline)
     try:
         pdf_orig = cast(bytes, img2pdf.convert(img_bytes))
@@ -271,55 +773,48 @@ def estimate_image_pdf_size(img_bytes: bytes, level: str) -> int:
         pdf_orig = img_bytes
     base_len = len(pdf_orig)
 
-    params = LEVELS.get(level or "none", LEVELS["none"])
-    mode = params["mode"]
-    if mode == "none":
-        return base_len
-
-    im = Image.open(io.BytesIO(img_bytes))
-    if im.mode in ("RGBA", "P"):
-        im = im.convert("RGB")
-
-    # Regras calibradas por nível (ajuste fino livre)
-    if level == "min":
-        q_start = 88
-        keep_max = 0.75   # <= 75% do baseline → ≥25% de redução
-        keep_min = 0.65   # >= 65% do baseline → ≤35% de redução
-        max_side = None
-    elif level == "med":
-        q_start = 75
-        keep_max = 0.48   # <= 48% → ≥52% de redução
-        keep_min = 0.30   # >= 30% → ≤70% de redução
-        max_side = 1280
-    elif level == "max":
-        q_start = 65
-        keep_max = 0.30   # <= 30% → ≥70% de redução
-        keep_min = None
-        max_side = 2000
-    else:
-        return base_len
-
-    # Downscale (se configurado para o nível)
-    if max_side is not None:
-        w, h = im.size
-        scale = min(max_side / max(w, h), 1.0)
-        if scale < 1.0:
-            im = im.resize((int(w * scale), int(h * scale)), RESAMPLE_LANCZOS)
-
-    # JPEG dentro da faixa vs baseline
-    q_floor = 45 if level == "min" else (30 if level == "med" else 24)
-    subsamp = None if level == "min" else 2  # 4:2:0 no méd/max
-    jpg_bytes, _ok_floor = _jpeg_bytes_with_band(
-        im, q_start, keep_min, keep_max, base_len, q_floor=q_floor, subsamp_default=subsamp
-    )
+    out: Dict[str, int] = {}
+    lossy: List[str] = []
+    for level in levels:
+        mode = LEVELS.get(level or "none", LEVELS["none"])["mode"]
+        if mode == "none" or level not in _IMG_EST_RULES:
+            out[level] = base_len
+        elif level not in lossy:
+            lossy.append(level)
+    if not lossy:
+        return out
+
+    im0 = Image.open(io.BytesIO(img_bytes))
+    if im0.mode in ("RGBA", "P"):
+        im0 = im0.convert("RGB")
+
+    for k, level in enumerate(lossy):
+        q_start, keep_min, keep_max, max_side, q_floor, subsamp = _IMG_EST_RULES[level]
+        # cada nível parte do original (JPEG reabre: o draft() do nível anterior
+        # já reduziu o decode de im0)
+        src = Image.open(io.BytesIO(img_bytes)) if (k > 0 and im0.format == "JPEG") else im0
+        im = _downscale_max_side(src, max_side)
+
+        # JPEG dentro da faixa vs baseline; mesma entrada do image_to_pdf_bytes,
+        # então a busca pode ser compartilhada com ele
+        jpg_bytes, _ok_floor = _jpeg_bytes_with_band(
+            im, q_start, keep_min, keep_max, base_len, q_floor=q_floor, subsamp_default=subsamp,
+            memo_key=_band_key(img_bytes, level),
+        )
+
+        # Monta PDF do candidato e aplica guard-rail vs baseline
+        try:
+            pdf_out = cast(bytes, img2pdf.convert(jpg_bytes))
+        except Exception:
+            pdf_out = jpg_bytes + b"\x00" * 1024
+        out[level] = len(pdf_out) if len(pdf_out) < base_len else base_len
+    return out
 
-    # Monta PDF do candidato e aplica guard-rail vs baseline
-    try:
-        pdf_out = cast(bytes, img2pdf.convert(jpg_bytes))
-    except Exception:
-        pdf_out = jpg_bytes + b"\x00" * 1024
 
-    return len(pdf_out) if len(pdf_out) < base_len else base_len
+@_memo_by_digest
+def estimate_image_pdf_size(img_bytes: bytes, level: str) -> int:
+    """Estima o tamanho do PDF (1 página) gerado a partir de uma imagem, mirando a FAIXA vs PDF-base."""
+    return estimate_image_pdf_sizes(img_bytes, [level])[level]
 
 
 # ===========================
@@ -350,13 +845,24 @@ def compress_pdf(pdf_bytes: bytes, level: str | None) -> bytes:
     if mode == "all":
         try:
             src = fitz.open("pdf", pdf_bytes)
-            jpg_pages = []
-            for i in range(src.page_count):
-                pg = src.load_page(i)
-                pix = pg.get_pixmap(dpi=dpi, alpha=False)  # pyright: ignore[reportAttributeAccessIssue]
-                jpg_pages.append(pix.tobytes("jpeg", jpg_quality=jpg_q))
-            src.close()
-            out_bytes = cast(bytes, img2pdf.convert(jpg_pages))
+            try:
+                pages = list(range(src.page_count))
+                rects = [pg.rect for pg in src]
+                # atalho: piso do JPEG já >= original -> o guard-rail devolveria o original
+                floor = sum((dpi / 72.0) ** 2 * r.width * r.height for r in rects) * JPEG_MIN_BYTES_PER_PX
+                if floor >= len(pdf_bytes):
+                    return pdf_bytes
+                jpg_pages = _parallel_pages(_render_pages_jpeg, pdf_bytes, pages, dpi, jpg_q)
+                if jpg_pages is None:
+                    jpg_pages = _render_pages_jpeg(src, pages, dpi, jpg_q)  # mesmo doc, sem reabrir
+            finally:
+                src.close()
+            # JPEGs entram direto como páginas (sem img2pdf): 1 embed por página
+            dst = fitz.open()
+            for r, jpg_b in zip(rects, jpg_pages):
+                _add_jpeg_page(dst, r, jpg_b)
+            out_bytes = dst.write(**PDF_WRITE_OPTS)  # pyright: ignore[reportArgumentType]
+            dst.close()
             return out_bytes if len(out_bytes) < len(pdf_bytes) else pdf_bytes
         except Exception:
             return pdf_bytes
@@ -367,22 +873,25 @@ def compress_pdf(pdf_bytes: bytes, level: str | None) -> bytes:
             src = fitz.open("pdf", pdf_bytes)
             dst = fitz.open()
 
-            def _copy_page(dst_doc, src_doc, i: int):
-                dst_doc.insert_pdf(src_doc, from_page=i, to_page=i)
-
-            def _rasterize_to(dst_doc, page_obj: "fitz.Page", dpi_val: int, jpeg_q: int):
-                pix = page_obj.get_pixmap(dpi=dpi_val, alpha=False)  # pyright: ignore[reportAttributeAccessIssue]
-                img_bytes = pix.tobytes("jpeg", jpg_quality=jpeg_q)
-                rect = page_obj.rect
-                p = dst_doc.new_page(width=rect.width, height=rect.height)
-                p.insert_image(rect, stream=img_bytes)
+            # só as páginas "imagem-only" são rasterizadas (em paralelo quando compensa)
+            img_only = [i for i in range(src.page_count) if _is_image_only(src.load_page(i))]
+            jpgs = _parallel_pages(_render_pages_jpeg, pdf_bytes, img_only, dpi, jpg_q)
+            if jpgs is None:
+                jpgs = _render_pages_jpeg(src, img_only, dpi, jpg_q)  # mesmo doc, sem reabrir
+            jpg_by_page = dict(zip(img_only, jpgs))
 
+            # páginas mantidas contíguas vão num único insert_pdf(from..to)
+            run_start = None
             for i in range(src.page_count):
-                page = src.load_page(i)
-                if _is_image_only(page):
-                    _rasterize_to(dst, page, dpi, jpg_q)  # pyright: ignore[reportAttributeAccessIssue]
-                else:
-                    _copy_page(dst, src, i)
+                if i in jpg_by_page:
+                    if run_start is not None:
+                        dst.insert_pdf(src, from_page=run_start, to_page=i - 1)
+                        run_start = None
+                    _add_jpeg_page(dst, src.load_page(i).rect, jpg_by_page[i])
+                elif run_start is None:
+                    run_start = i
+            if run_start is not None:
+                dst.insert_pdf(src, from_page=run_start, to_page=src.page_count - 1)
 
             out_bytes = dst.write(garbage=4, deflate=True, clean=True)# pyright: ignore[reportArgumentType]
             dst.close()
@@ -404,41 +913,18 @@ def image_to_pdf_bytes(file_bytes: bytes, level: str | None) -> bytes:
         pdf_orig = file_bytes
     base_len = len(pdf_orig)
 
-    if not level or level == "none":
+    if not level or level not in _IMG_EST_RULES:
         return pdf_orig
+    q_start, keep_min, keep_max, max_side, q_floor, subsamp = _IMG_EST_RULES[level]
 
     im = Image.open(io.BytesIO(file_bytes))
     if im.mode in ("RGBA", "P"):
         im = im.convert("RGB")
+    im = _downscale_max_side(im, max_side)
 
-    if level == "min":
-        q_start = 88
-        keep_max = 0.75
-        keep_min = 0.65
-        max_side = None
-    elif level == "med":
-        q_start = 75
-        keep_max = 0.48
-        keep_min = 0.30
-        max_side = 1280
-    elif level == "max":
-        q_start = 65
-        keep_max = 0.30
-        keep_min = None
-        max_side = 2000
-    else:
-        return pdf_orig
-
-    if max_side is not None:
-        w, h = im.size
-        scale = min(max_side / max(w, h), 1.0)
-        if scale < 1.0:
-            im = im.resize((int(w * scale), int(h * scale)), RESAMPLE_LANCZOS)
-
-    q_floor = 45 if level == "min" else (30 if level == "med" else 24)
-    subsamp = None if level == "min" else 2  # 4:2:0 no méd/max
     jpg_bytes, _ok_floor = _jpeg_bytes_with_band(
-        im, q_start, keep_min, keep_max, base_len, q_floor=q_floor, subsamp_default=subsamp
+        im, q_start, keep_min, keep_max, base_len, q_floor=q_floor, subsamp_default=subsamp,
+        memo_key=_band_key(file_bytes, level),  # reaproveita a busca da estimativa
     )
 
     # Converte candidato para PDF e aplica guard-rail
@@ -454,72 +940,222 @@ def image_to_pdf_bytes(file_bytes: bytes, level: str | None) -> bytes:
 # ===========================
 #   UNIÃO / MERGE
 # ===========================
-def merge_items(items: List[Tuple[str, bytes, str, str]]) -> bytes:
+def _item_to_pdf(data: bytes, kind: str, level: str) -> bytes:
+    """Worker: um item (PDF/imagem) -> PDF já comprimido/convertido no nível."""
+    if kind == "pdf":
+        return compress_pdf(data, level)
+    # imagem -> PDF 1 página (respeita o nível)
+    return image_to_pdf_bytes(data, level)
+
+
+def _convert_items_parallel(items: List[Tuple[str, bytes, str, str]]) -> List[bytes | None] | None:
+    """
+    Converte em processos os itens com compressão (os 'none' são baratos e
+    ficam para o chamador). Devolve a lista alinhada com 'items' (None onde
+    não converteu) ou None quando não vale a pena (1 CPU, < 2 itens pesados, pouco volume).
+    """
+    heavy = [k for k, (_, _, _, level) in enumerate(items) if level and level != "none"]
+    workers = pool_workers(len(heavy))
+    if workers < 2 or sum(len(items[k][1]) for k in heavy) < PARALLEL_MIN_ITEM_BYTES:
+        return None
+    out: List[bytes | None] = [None] * len(items)
+    try:
+        with process_pool(workers) as ex:
+            futs = {k: ex.submit(_item_to_pdf, items[k][1], items[k][2], items[k][3]) for k in heavy}
+            for k, fut in futs.items():
+                try:
+                    out[k] = fut.result()
+                except Exception:
+                    pass  # refeito em série pelo chamador (e o erro aparece lá)
+    except Exception:
+        return None
+    return out
+
+
+def merge_items(
+    items: List[Tuple[str, bytes, str, str]],
+    out: IO[bytes] | None = None,
+) -> bytes | None:
     """Une itens (PDF/imagem) em um único PDF.
 
     Para 'pdf', aplica compressão por item; para 'image', converte imagem→PDF.
 
     Args:
         items (List[Tuple[str, bytes, str, str]]): Tuplas (name, data, kind, level).
+        out (IO[bytes] | None): Se informado, o PDF é salvo direto nesse
+            stream (sem montar um bytes intermediário) e a função devolve None.
 
     Returns:
-        bytes: PDF final unificado.
+        bytes | None: PDF final unificado (None quando 'out' é usado).
     """
 
-    writer = PdfWriter()
+    dst = fitz.open()
     errors: List[str] = []
 
     def _append_pdf_bytes(pdf_b: bytes):
+        # insert_pdf copia os objetos no próprio MuPDF (sem reparse em Python)
         try:
-            reader = PdfReader(io.BytesIO(pdf_b))
-            if reader.is_encrypted:
-                try:
-                    reader.decrypt("")
-                except Exception:
-                    errors.append("PDF criptografado; ignorado.")
-                    return
-            for page in reader.pages:
-                writer.add_page(page)
+            src = fitz.open("pdf", pdf_b)
+        except Exception as e:
+            errors.append(f"Falha ao anexar PDF: {e}")
+            return
+        try:
+            if src.needs_pass and not src.authenticate(""):
+                errors.append("PDF criptografado; ignorado.")
+                return
+            dst.insert_pdf(src)
         except Exception as e:
             errors.append(f"Falha ao anexar PDF: {e}")
+        finally:
+            src.close()
 
-    for name, data, kind, level in items:
-        if kind == "pdf":
-            pdf_b = compress_pdf(data, level)
-            _append_pdf_bytes(pdf_b)
-        else:
-            # imagem -> PDF 1 página (respeita o nível)
-            pdf_b = image_to_pdf_bytes(data, level)
-            _append_pdf_bytes(pdf_b)
+    # itens independentes: os comprimidos saem em paralelo (se houver CPUs);
+    # a anexação segue em série e na ordem original
+    ready = _convert_items_parallel(items) or [None] * len(items)
+    for (name, data, kind, level), pdf_b in zip(items, ready):
+        if pdf_b is None:
+            pdf_b = _item_to_pdf(data, kind, level)
+        _append_pdf_bytes(pdf_b)
 
-    out_buf = io.BytesIO()
-    writer.write(out_buf)
-    return out_buf.getvalue()
+    try:
+        if out is not None:
+            dst.save(out, **PDF_WRITE_OPTS)  # pyright: ignore[reportArgumentType]
+            return None
+        return dst.write(**PDF_WRITE_OPTS)  # pyright: ignore[reportArgumentType]
+    finally:
+        dst.close()
 
 def merge_pages(
     pages_flat: List[Tuple[str, bytes, str, int, str]],
-    rotation_seq: List[int] | None = None
-) -> bytes:
+    rotation_seq: List[int] | None = None,
+    out: IO[bytes] | None = None,
+) -> bytes | None:
     """Monta um PDF final a partir de páginas já flatten (ordem global).
 
     Permite aplicar rotação por página e compressão por página.
 
     Args:
         pages_flat (List[Tuple[str, bytes, str, int, str]]): (name, data, kind, page_idx, level).
+            Para 'pdf', 'data' pode ser bytes ou um fitz.Document já aberto.
         rotation_seq (List[int] | None): Ângulos por posição (0/90/180/270).
+        out (IO[bytes] | None): Se informado, o PDF é salvo direto nesse
+            stream (sem montar um bytes intermediário) e a função devolve None.
 
     Returns:
-        bytes: PDF final na ordem solicitada.
+        bytes | None: PDF final na ordem solicitada (None quando 'out' é usado).
     """
 
     dst = fitz.open()
     rotations = rotation_seq or [0] * len(pages_flat)
 
-    for pos, (name, data, kind, page_idx, level) in enumerate(pages_flat):
+    def _angle(pos: int) -> int:
         try:
-            angle = int(rotations[pos]) % 360
+            return int(rotations[pos]) % 360
         except Exception:
-            angle = 0
+            return 0
+
+    # Cada PDF de origem é aberto 1x (chave: identidade do buffer/Document).
+    # 'data' pode ser um fitz.Document já aberto (ex.: o da sessão): é usado
+    # direto e NÃO é fechado aqui.
+    src_docs: Dict[int, Tuple[fitz.Document, bool]] = {}
+
+    def _src(data: bytes | fitz.Document) -> fitz.Document:
+        hit = src_docs.get(id(data))
+        if hit is None:
+            hit = _open_pdf(data)
+            src_docs[id(data)] = hit
+        return hit[0]
+
+    # Candidatos rasterizados adiantados em processos (quando há CPUs e páginas
+    # suficientes), em lotes: cada lote sai do pool, é consumido e inserido
+    # antes do próximo, então só um lote fica em memória. Chave de 'pre':
+    # (id(data), página, nível). Ficam de fora o que o memo do Document já tem
+    # (estimativa da sessão) e as páginas 'smart' já classificadas como
+    # texto/vetor (o candidato seria None, sem rasterizar).
+    todo: List[Tuple[int, int, bytes, int, str]] = []  # (posição, id(data), pdf, página, nível)
+    seen: set = set()
+    for at, (_, data, kind, page_idx, level) in enumerate(pages_flat):
+        if kind != "pdf":
+            continue
+        pdf_b = data if isinstance(data, (bytes, bytearray)) else getattr(data, "stream", None)
+        if not isinstance(pdf_b, (bytes, bytearray)):
+            continue
+        memo = getattr(data, "_cand_memo", None) or {}
+        io_memo = getattr(data, "_image_only_memo", None) or {}
+        for lk in _guardrail_levels(level):
+            key = (id(data), page_idx, lk)
+            if key in seen or _cand_memo_key(page_idx, lk) in memo:
+                continue
+            if LEVELS[lk]["mode"] == "smart" and io_memo.get(page_idx) is False:
+                continue
+            seen.add(key)
+            todo.append((at, id(data), pdf_b, page_idx, lk))
+
+    pre: Dict[Tuple[int, int, str], bytes | None] = {}
+    workers = pool_workers(math.ceil(len(todo) / PARALLEL_BATCH_PAGES))
+    ex = process_pool(workers) if workers >= 2 and len(todo) >= PARALLEL_MIN_PAGES else None
+    cursor = 0
+
+    def _prefetch(at: int) -> None:
+        """Gera o próximo lote de 'todo' quando o laço chega à 1ª posição dele."""
+        nonlocal cursor, ex
+        if ex is None or cursor >= len(todo) or todo[cursor][0] > at:
+            return
+        # lote fecha em fronteira de posição (os níveis de uma página vêm juntos)
+        end = min(cursor + workers * PARALLEL_BATCH_PAGES, len(todo))
+        while end < len(todo) and todo[end][0] == todo[end - 1][0]:
+            end += 1
+        groups: Dict[int, Tuple[bytes, List[Tuple[int, str]]]] = {}
+        for _, key_src, pdf_b, pi, lk in todo[cursor:end]:
+            groups.setdefault(key_src, (pdf_b, []))[1].append((pi, lk))
+        cursor = end
+        pre.clear()  # sobras de páginas que falharam no lote anterior
+        try:
+            futs = [
+                (key_src, part, ex.submit(_render_page_candidates, pdf_b, part))
+                for key_src, (pdf_b, items) in groups.items()
+                for part in (items[k:k + PARALLEL_BATCH_PAGES] for k in range(0, len(items), PARALLEL_BATCH_PAGES))
+            ]
+            for key_src, part, fut in futs:
+                pre.update({(key_src, pi, lk): c for (pi, lk), c in zip(part, fut.result())})
+        except Exception:
+            cursor = len(todo)  # pool falhou: o restante segue em série
+        if cursor >= len(todo):
+            ex.shutdown(cancel_futures=True)
+            ex = None
+
+    n_items = len(pages_flat)
+    pos = 0
+    while pos < n_items:
+        name, data, kind, page_idx, level = pages_flat[pos]
+        angle = _angle(pos)
+        pos += 1
+
+        # Run de páginas 'none' contíguas do mesmo PDF: uma cópia de intervalo
+        # (insert_pdf from..to) em vez de uma inserção por página
+        if kind == "pdf" and level == "none":
+            run_end = pos
+            while run_end < n_items:
+                _, d2, k2, p2, l2 = pages_flat[run_end]
+                if d2 is not data or k2 != "pdf" or l2 != "none" or p2 != page_idx + (run_end - pos + 1):
+                    break
+                run_end += 1
+            try:
+                src = _src(data)
+                last = page_idx + (run_end - pos)
+                if page_idx < 0 or last >= src.page_count:
+                    raise IndexError(page_idx)
+                first_dst = dst.page_count
+                dst.insert_pdf(src, from_page=page_idx, to_page=last)
+                for k, p_run in enumerate(range(pos - 1, run_end)):
+                    a = _angle(p_run)
+                    if a:
+                        dst[first_dst + k].set_rotation(a)  # pyright: ignore[reportAttributeAccessIssue]
+                pos = run_end
+                continue
+            except Exception:
+                # intervalo inválido/falha: segue pelo caminho página a página
+                pass
 
         if kind == "image":
             # imagem -> PDF bytes (respeita level) -> anexar página
@@ -539,13 +1175,13 @@ def merge_pages(
 
         # kind == 'pdf'
         try:
-            src = fitz.open("pdf", data)
+            src = _src(data)
             if page_idx < 0 or page_idx >= src.page_count:
-                src.close()
                 continue
 
             # Página fonte
             pg = src.load_page(page_idx)
+            _prefetch(pos - 1)
 
             # 1) base_bytes: PDF 1:1 só com esta página (nenhuma alteração)
             base_doc = fitz.open()
@@ -555,50 +1191,29 @@ def merge_pages(
 
             # 2) helper local: gera candidato conforme 'level_key' e LEVELS
             def _cand(level_key: str) -> bytes:
-                params = LEVELS.get(level_key, LEVELS["none"])
-                mode = params["mode"]
-                dpi  = params["dpi"]
-                jpg_q = params["jpg_q"]
-
-                # none -> sempre devolve o base
-                if mode == "none":
-                    return base_bytes
-
-                # smart: só rasteriza se for imagem-only, senão mantém base
-                if mode == "smart" and not _is_image_only(pg):
-                    return base_bytes
-
-                # all OU smart+imagem-only -> rasteriza esta página
-                dpi_eff = _cap_dpi_for_page(pg, int(dpi or 150))
-                mat = fitz.Matrix(dpi_eff/72.0, dpi_eff/72.0)
-                pix = pg.get_pixmap(matrix=mat, alpha=False, colorspace=fitz.csRGB)  # pyright: ignore[reportAttributeAccessIssue]
-                jpg_b = pix.tobytes("jpeg", jpg_quality=int(jpg_q or 75))
-                del pix
-                try:
-                    return cast(bytes, img2pdf.convert(jpg_b))  # embrulha em PDF 1-pag
-                except Exception:
-                    # fallback bruto (raríssimo): retorna o JPEG solto; inserir_pdf abaixo falharia,
-                    # então preferimos cair pro base_bytes na comparação.
-                    return jpg_b
-
-            # 3) gera os candidatos respeitando monotonicidade (max ≤ med ≤ min ≤ base)
-            #    - min: compara base vs min
-            #    - med: compara base vs min vs med
-            #    - max: compara base vs min vs med vs max
-            if level == "min":
-                cand_min = _cand("min")
-                chosen = min((base_bytes, cand_min), key=len)
-            elif level == "med":
-                cand_min = _cand("min")
-                cand_med = _cand("med")
-                chosen = min((base_bytes, cand_min, cand_med), key=len)
-            elif level == "max":
-                cand_min = _cand("min")
-                cand_med = _cand("med")
-                cand_max = _cand("max")
-                chosen = min((base_bytes, cand_min, cand_med, cand_max), key=len)
-            else:
-                chosen = base_bytes  # none
+                # none / smart em página com texto -> base; senão a página
+                # rasterizada (já pronta se a estimativa passou por ela).
+                # Fallback raríssimo: JPEG solto; o fitz.open abaixo falha e
+                # cai pro base_bytes.
+                hit = (id(data), page_idx, level_key)
+                if hit not in pre:
+                    cand = _page_candidate(pg, level_key)
+                else:
+                    # veio do pool: guarda no memo do Document, como o caminho em
+                    # série faria (um 2º Gerar na sessão não rasteriza de novo)
+                    cand = pre.pop(hit)
+                    if LEVELS[level_key]["mode"] == "smart":
+                        io_memo = _doc_memo(src, "_image_only_memo", dict)
+                        if io_memo is not None:
+                            io_memo[page_idx] = cand is not None
+                    memo = _doc_memo(src, "_cand_memo", OrderedDict)
+                    if cand is not None and memo is not None and cand.startswith(b"%PDF"):
+                        _cand_memo_put(memo, _cand_memo_key(page_idx, level_key), cand)
+                return base_bytes if cand is None else cand
+
+            # 3) gera os candidatos respeitando monotonicidade (max ≤ med ≤ min ≤ base);
+            #    níveis dominados da escada nem são gerados (_guardrail_levels)
+            chosen = min([base_bytes] + [_cand(k) for k in _guardrail_levels(level)], key=len)
 
             # 4) insere a VERSÃO MENOR no destino e aplica rotação
             try:
@@ -611,22 +1226,25 @@ def merge_pages(
             one.close()
             if angle:
                 dst[-1].set_rotation(angle)  # pyright: ignore[reportAttributeAccessIssue]
-
-            src.close()
             continue
 
 
         except Exception:
             # falha isolada numa página não bloqueia o restante
-            try:
-                src.close()
-            except Exception:
-                pass
             continue
 
-    out_bytes = dst.write(garbage=4, deflate=True, clean=True)  # pyright: ignore[reportArgumentType]
-    dst.close()
-    return out_bytes
+    if ex is not None:
+        ex.shutdown(cancel_futures=True)
+    for doc, owned in src_docs.values():
+        if owned:
+            doc.close()
+    try:
+        if out is not None:
+            dst.save(out, **PDF_WRITE_OPTS)  # pyright: ignore[reportArgumentType]
+            return None
+        return dst.write(**PDF_WRITE_OPTS)  # pyright: ignore[reportArgumentType]
+    finally:
+        dst.close()
 
 # ===========================
 #   DIVIDIR / GIRAR
@@ -643,23 +1261,79 @@ def split_pdf(pdf_bytes: bytes, keep_pages_0based: List[int], rotation_map: Dict
         bytes: PDF contendo apenas as páginas escolhidas (com rotações).
     """
 
-    src = fitz.open("pdf", pdf_bytes)
-    dst = fitz.open()
+    # select() recorta a própria cópia do documento numa passada só no MuPDF
+    # (em vez de um insert_pdf por intervalo); o que sobra do catálogo
+    # (marcadores, metadados) fica só com as páginas mantidas
+    doc = fitz.open("pdf", pdf_bytes)
+    try:
+        keep = [i for i in sorted(set(keep_pages_0based)) if 0 <= i < doc.page_count]
+        if not keep:  # select([]) falharia com um 'bad page number(s)' enganoso
+            raise ValueError("nenhuma página selecionada")
+        doc.select(keep)
+        if rotation_map:
+            for pos, i in enumerate(keep):
+                if i in rotation_map:
+                    try:
+                        doc[pos].set_rotation(rotation_map[i] % 360)
+                    except Exception:
+                        pass
+        out_bytes = doc.write(**PDF_WRITE_OPTS)  # pyright: ignore[reportArgumentType]
+    finally:
+        doc.close()
+    return out_bytes
 
-    for i in sorted(set(keep_pages_0based)):
-        if i < 0 or i >= src.page_count:
-            continue
-        dst.insert_pdf(src, from_page=i, to_page=i)
-        if rotation_map and i in rotation_map:
-            angle = rotation_map[i] % 360
-            dp = dst[-1]
-            try:
-                dp.set_rotation(angle)
-            except Exception:
-                pass
 
+# ===========================
+#   PREVIEW (rasters da UI)
+# ===========================
+def _may_be_mono(pg: "fitz.Page") -> bool:
+    """Teste rápido: página sem imagens nem anotações (candidata a raster em cinza)."""
+    try:
+        return not pg.get_images(full=False) and pg.first_annot is None  # type: ignore[attr-defined]
+    except Exception:
+        return False
 
-    out_bytes = dst.write(garbage=4, deflate=True, clean=True)# pyright: ignore[reportArgumentType]
-    dst.close()
-    src.close()
-    return out_bytes
+
+def render_page_raster(pg: "fitz.Page", dpi: int, box: tuple[int, int]) -> np.ndarray:
+    """Rasteriza uma página do PyMuPDF já no tamanho final (cabe no box w×h).
+
+    O zoom é calculado para o MuPDF entregar direto o raster reduzido (sem
+    render em 'dpi' + redução no PIL); 'dpi' é só o teto, como antes — nunca
+    amplia. As amostras do pixmap viram array sem passar pelo PIL.
+
+    Returns:
+        np.ndarray: uint8 (H, W, 3), ou (H, W) se a página for monocromática.
+    """
+    r = pg.rect
+    zoom = min(dpi / 72.0, box[0] / max(r.width, 1.0), box[1] / max(r.height, 1.0))
+    mat = fitz.Matrix(zoom, zoom)
+    pix = pg.get_pixmap(matrix=mat, colorspace=fitz.csRGB, alpha=False)  # type: ignore[attr-defined]
+    arr = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, 3)
+    # raster sem matiz vira 1 canal: 1/3 do espaço no _pix_cache (a comparação
+    # roda sobre o raster já reduzido; páginas com imagem nem são testadas)
+    if _may_be_mono(pg) and (arr[:, :, 0] == arr[:, :, 1]).all() and (arr[:, :, 1] == arr[:, :, 2]).all():
+        return arr[:, :, 0].copy()
+    return arr
+
+
+def render_pdf_rasters(data: bytes, pages: list[int], dpi: int, box: tuple[int, int]) -> list[np.ndarray]:
+    """Worker do pré-aquecimento (app_helpers): rasteriza várias páginas de UM PDF.
+
+    Função de módulo (picklable) para rodar em ProcessPoolExecutor: cada
+    tarefa abre o próprio documento, já que fitz.Document não é thread-safe.
+
+    Args:
+        data (bytes): Bytes do PDF.
+        pages (list[int]): Índices 0-based das páginas.
+        dpi (int): Resolução de rasterização.
+        box (tuple[int, int]): Box (w, h) do raster final.
+
+    Returns:
+        list[np.ndarray]: Um array (RGB ou L) por página, na mesma ordem de 'pages'.
+    """
+
+    doc = fitz.open("pdf", data)
+    try:
+        return [render_page_raster(doc.load_page(pi), dpi, box) for pi in pages]
+    finally:
+        doc.close()